@@ -1,17 +1,250 @@
-import vtk
+# vtkmodules subsets instead of the vtk umbrella module keep the window startup fast
+import vtkmodules.vtkInteractionStyle
+import vtkmodules.vtkRenderingOpenGL2
+from vtkmodules.vtkRenderingVolumeOpenGL2 import vtkSmartVolumeMapper
+from vtkmodules.vtkCommonDataModel import vtkImageData, vtkPiecewiseFunction
+from vtkmodules.vtkImagingCore import vtkImageShrink3D
+from vtkmodules.vtkIOImage import vtkNrrdReader
+from vtkmodules.vtkRenderingCore import vtkActor, vtkCamera, vtkColorTransferFunction, vtkLODProp3D, vtkPolyDataMapper, vtkRenderer, vtkTextActor, vtkVolume, vtkVolumeProperty
+from vtkmodules.vtkRenderingVolume import vtkFixedPointVolumeRayCastMapper, vtkGPUVolumeRayCastMapper
+import os
+import time
 import random
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
 from PyQt5.QtWidgets import  QFrame
+from profiling import tracer, traced
+from frame_telemetry import FRAME_OVERLAY_ENABLED, FrameTelemetry, format_summary
+
+INTERACTIVE_UPDATE_RATE = 15.0
+STILL_UPDATE_RATE = 0.001
+# Downsampling factors of the volume proxy pyramid, the first level is the full resolution volume
+VOLUME_PROXY_FACTORS = (1, 2, 4)
+# Ray step lengths in units of each level's voxel spacing
+STILL_SAMPLE_DISTANCE = 0.5
+INTERACTIVE_SAMPLE_DISTANCE = 1.0
+# The CPU mapper is what headless snapshots use when there is no GPU; smart picks GPU or CPU from the context
+VOLUME_MAPPERS = {"gpu": vtkGPUVolumeRayCastMapper, "cpu": vtkFixedPointVolumeRayCastMapper, "smart": vtkSmartVolumeMapper}
+# gpu, cpu, smart, or auto for the fastest backend measured on this machine
+VOLUME_MAPPER = os.environ.get("RENDER_VOLUME_MAPPER", "auto")
+# CPU ray cast threads, 0 keeps VTK's default of one per core
+VOLUME_THREADS = int(os.environ.get("RENDER_VOLUME_THREADS", "0"))
+# Lets the mapper coarsen its sampling to meet the update rate the interactor asks for
+AUTO_SAMPLE_DISTANCE = os.environ.get("RENDER_AUTO_SAMPLE_DISTANCE", "0") not in ("", "0")
+RAW_CACHE_ENABLED = os.environ.get("PIPELINE_RAW_CACHE", "1") not in ("", "0")
+LINK_CAMERAS = os.environ.get("RENDER_LINK_CAMERAS", "0") not in ("", "0")
+# Bytes the grid may hold across all cells before the least recently viewed cell is cleared, 0 disables the budget
+DEFAULT_MEMORY_BUDGET = 4 * 1024 ** 3
+MEMORY_BUDGET = int(os.environ.get("RENDER_MEMORY_BUDGET_BYTES", DEFAULT_MEMORY_BUDGET))
+# Mappers that upload the scalars as a 3D texture
+TEXTURE_MAPPERS = ("gpu", "smart")
+DEFAULT_VOLUME_PRESET = "ct_soft_tissue"
+VOLUME_PRESETS = {
+    "ct_soft_tissue": {
+        "color": [(0, 0.0, 0.0, 0.0), (500, 240.0 / 255.0, 184.0 / 255.0, 160.0 / 255.0),
+                  (1150, 240.0 / 255.0, 184.0 / 255.0, 160.0 / 255.0), (1500, 1.0, 1.0, 240.0 / 255.0)],
+        "scalar_opacity": [(0, 0.00), (500, 0.15), (1150, 0.15), (1500, 0.85)],
+        "gradient_opacity": [(0, 0.0), (90, 0.5), (100, 1.0)],
+        "shade": True,
+        "ambient": 0.4,
+        "diffuse": 0.6,
+        "specular": 0.2,
+    },
+}
+
+def create_volume_property(preset, interactive=False):
+    colorTransferFunction = vtkColorTransferFunction()
+    for point in preset["color"]:
+        colorTransferFunction.AddRGBPoint(*point)
+    volumeScalarOpacity = vtkPiecewiseFunction()
+    for point in preset["scalar_opacity"]:
+        volumeScalarOpacity.AddPoint(*point)
+    volumeGradientOpacity = vtkPiecewiseFunction()
+    for point in preset["gradient_opacity"]:
+        volumeGradientOpacity.AddPoint(*point)
+    volume_property = vtkVolumeProperty()
+    volume_property.SetColor(colorTransferFunction)
+    volume_property.SetScalarOpacity(volumeScalarOpacity)
+    volume_property.SetGradientOpacity(volumeGradientOpacity)
+    volume_property.SetInterpolationTypeToLinear()
+    volume_property.SetShade(preset["shade"])
+    volume_property.SetAmbient(preset["ambient"])
+    volume_property.SetDiffuse(preset["diffuse"])
+    volume_property.SetSpecular(preset["specular"])
+    if interactive:
+        # Proxies drawn while rotating skip the gradient based shading and opacity
+        volume_property.ShadeOff()
+        volume_property.DisableGradientOpacityOn()
+    return volume_property
+
+def shrink_image_data(image_data, factor):
+    shrink = vtkImageShrink3D()
+    shrink.SetInputData(image_data)
+    shrink.SetShrinkFactors(factor, factor, factor)
+    shrink.AveragingOn()
+    shrink.Update()
+    proxy = vtkImageData()
+    proxy.ShallowCopy(shrink.GetOutput())
+    # An averaged voxel sits at the center of the block it covers
+    origin = [0.0, 0.0, 0.0]
+    image_data.TransformContinuousIndexToPhysicalPoint([(factor - 1) / 2.0] * 3, origin)
+    proxy.SetOrigin(origin)
+    return proxy
+
+@traced("volume_proxies")
+def build_volume_proxies(image_data):
+    # Each level is shrunk from the previous one
+    proxies = [(1, image_data)]
+    for factor in VOLUME_PROXY_FACTORS[1:]:
+        previous_factor, previous = proxies[-1]
+        proxies.append((factor, shrink_image_data(previous, factor // previous_factor)))
+    return proxies
+
+def create_volume_mapper(image_data, sample_distance, mapper_type="gpu", number_of_threads=0, auto_sample_distance=False):
+    volume_mapper = VOLUME_MAPPERS[mapper_type]()
+    volume_mapper.SetInputData(image_data)
+    volume_mapper.SetAutoAdjustSampleDistances(auto_sample_distance)
+    volume_mapper.SetSampleDistance(sample_distance * min(image_data.GetSpacing()))
+    if mapper_type == "smart":
+        volume_mapper.SetInteractiveAdjustSampleDistances(auto_sample_distance)
+    if mapper_type == "cpu" and number_of_threads > 0:
+        volume_mapper.SetNumberOfThreads(number_of_threads)
+    return volume_mapper
+
+def create_volume_prop(volume_proxies, still_property, interactive_property, still_sample_distance=STILL_SAMPLE_DISTANCE,
+                       interactive_sample_distance=INTERACTIVE_SAMPLE_DISTANCE, mapper_type="gpu", number_of_threads=0, auto_sample_distance=False):
+    if len(volume_proxies) == 1:
+        volume = vtkVolume()
+        volume.SetMapper(create_volume_mapper(volume_proxies[0][1], still_sample_distance, mapper_type, number_of_threads, auto_sample_distance))
+        volume.SetProperty(still_property)
+        return volume
+    # Same selection as the mesh LODs: the coarse proxies win while the interactor asks for
+    # its interactive rate and the full resolution level comes back with the still rate on release
+    volume = vtkLODProp3D()
+    for level, (factor, image_data) in enumerate(volume_proxies):
+        if factor == 1:
+            volume_mapper = create_volume_mapper(image_data, still_sample_distance, mapper_type, number_of_threads, auto_sample_distance)
+            lod_id = volume.AddLOD(volume_mapper, still_property, 0.0)
+        else:
+            volume_mapper = create_volume_mapper(image_data, interactive_sample_distance, mapper_type, number_of_threads, auto_sample_distance)
+            lod_id = volume.AddLOD(volume_mapper, interactive_property, 0.0)
+        volume.SetLODLevel(lod_id, float(level))
+    volume.AutomaticLODSelectionOn()
+    return volume
+
+def create_polydata_actor(poly_data_lods):
+    if len(poly_data_lods) == 1:
+        mapper = vtkPolyDataMapper()
+        mapper.SetInputData(poly_data_lods[0])
+        actor = vtkActor()
+        actor.SetMapper(mapper)
+        return actor
+    # vtkLODProp3D picks the finest level that fits the time the interactor allocates to a frame
+    actor = vtkLODProp3D()
+    for level, poly_data in enumerate(poly_data_lods):
+        mapper = vtkPolyDataMapper()
+        mapper.SetInputData(poly_data)
+        lod_id = actor.AddLOD(mapper, 0.0)
+        actor.SetLODLevel(lod_id, float(level))
+    actor.AutomaticLODSelectionOn()
+    return actor
+
+def unique_objects(objects):
+    # Cells showing the same file share the same data objects, they are only counted once
+    return list({id(data_object): data_object for data_object in objects}.values())
+
+class GridCell:
+    # Everything one grid cell owns; clearing the cell drops the last references to its props, mappers and inputs
+    def __init__(self):
+        self.props = []
+        self.image_data = []
+        self.poly_data = []
+        self.volume_key = None
+        self.mapper_type = None
+        self.last_viewed = 0.0
+
+    def texture_objects(self):
+        return self.image_data if self.mapper_type in TEXTURE_MAPPERS else []
+
+    def memory(self):
+        image_bytes = sum(image_data.GetActualMemorySize() for image_data in unique_objects(self.image_data)) * 1024
+        poly_bytes = sum(poly_data.GetActualMemorySize() for poly_data in unique_objects(self.poly_data)) * 1024
+        # Estimated, one texture per proxy level with the scalar type of its image
+        texture_bytes = sum(image_data.GetNumberOfPoints() * image_data.GetScalarSize() * image_data.GetNumberOfScalarComponents()
+                            for image_data in unique_objects(self.texture_objects()))
+        return {"image_data": image_bytes, "poly_data": poly_bytes, "textures": texture_bytes,
+                "total": image_bytes + poly_bytes + texture_bytes}
+
+class RenderScheduler(QObject):
+    # Render requests are marked dirty and coalesced into at most one Render() per cell per event loop tick
+    def __init__(self, vtk_widgets):
+        super(RenderScheduler, self).__init__()
+        self.vtk_widgets = vtk_widgets
+        self.dirty = {}
+        self.flushing = False
+        self.frame_count = 0
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.flush)
+
+    def request_render(self, index=None, update_rate=None):
+        for cell in (range(len(self.vtk_widgets)) if index is None else (index,)):
+            self.dirty[cell] = update_rate if update_rate is not None else self.dirty.get(cell)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        dirty, self.dirty = self.dirty, {}
+        self.flushing = True
+        try:
+            for index, update_rate in sorted(dirty.items()):
+                render_window = self.vtk_widgets[index].GetRenderWindow()
+                if update_rate is not None:
+                    # Linked cells follow the rate of the cell being interacted with, so they draw the same proxy level
+                    render_window.SetDesiredUpdateRate(update_rate)
+                with tracer.span("render_window", cell=index):
+                    render_window.Render()
+                self.frame_count += 1
+        finally:
+            self.flushing = False
 
 class VolumeRenderer(QFrame):
+    poly_data_ready = pyqtSignal(object)
+
     def __init__(self, vtk_widgets):
         super(VolumeRenderer, self).__init__()
         self.filename = None
         self.all_vtk_widgets = vtk_widgets
         self.renderer_list = []
-        self.actor_list = [] 
+        self.cells = [GridCell() for _ in vtk_widgets]
+        self.memory_budget = MEMORY_BUDGET
         self.next_grid_index = 0 
         self.poly_data = None
+        self.poly_data_lods = []
+        self.volume_preset = DEFAULT_VOLUME_PRESET
+        self.image_data_cache = {}
+        self.volume_properties = {}
+        self.volume_proxies = {}
+        self.preview_filename = None
+        self.render_scheduler = RenderScheduler(vtk_widgets)
+        self.camera_link = False
+        self.frame_telemetry = FrameTelemetry(len(vtk_widgets))
+        self.frame_overlay = False
+        self.overlay_actors = []
+        self.interactive_update_rate = INTERACTIVE_UPDATE_RATE
+        self.still_update_rate = STILL_UPDATE_RATE
+        self.still_sample_distance = STILL_SAMPLE_DISTANCE
+        self.interactive_sample_distance = INTERACTIVE_SAMPLE_DISTANCE
+        self.volume_mapper = VOLUME_MAPPER
+        self.volume_threads = VOLUME_THREADS
+        self.auto_sample_distance = AUTO_SAMPLE_DISTANCE
+        self.mapper_benchmark = None
         self.initialize_renderers()
+        if LINK_CAMERAS and self.renderer_list:
+            self.set_camera_link(True)
+        if FRAME_OVERLAY_ENABLED:
+            self.set_frame_overlay(True)
+        self.poly_data_ready.connect(self.show_poly_data)
 
     def render_data(self, data_type="volume"):
         if data_type == "volume":
@@ -22,73 +255,272 @@ class VolumeRenderer(QFrame):
     def set_filename(self, filename):
         self.filename = filename
 
-    def set_poly_data(self, poly_data):
+    def set_volume_preset(self, preset):
+        self.volume_preset = preset
+
+    def image_data_key(self, filename):
+        return (os.path.realpath(filename), os.path.getmtime(filename))
+
+    def load_image_data(self, filename):
+        key = self.image_data_key(filename)
+        if key not in self.image_data_cache and RAW_CACHE_ENABLED:
+            # Imported here so the raw cache stack (numpy, SimpleITK) stays out of the window startup
+            from raw_volume import read_raw_vtk_image
+            self.image_data_cache[key] = read_raw_vtk_image(filename)
+        if key not in self.image_data_cache:
+            reader = vtkNrrdReader()
+            reader.SetFileName(filename)
+            with tracer.span("nrrd_decode"):
+                reader.Update()
+            image_data = vtkImageData()
+            image_data.ShallowCopy(reader.GetOutput())
+            self.image_data_cache[key] = image_data
+        return self.image_data_cache[key]
+
+    def get_volume_property(self, preset=DEFAULT_VOLUME_PRESET, interactive=False):
+        if (preset, interactive) not in self.volume_properties:
+            self.volume_properties[(preset, interactive)] = create_volume_property(VOLUME_PRESETS[preset], interactive)
+        return self.volume_properties[(preset, interactive)]
+
+    def load_volume_proxies(self, filename):
+        key = self.image_data_key(filename)
+        if key not in self.volume_proxies:
+            # The pyramid is shared by every cell showing the file
+            self.volume_proxies[key] = build_volume_proxies(self.load_image_data(filename))
+        return self.volume_proxies[key]
+
+    def add_volume_proxies(self, filename, volume_proxies):
+        # Pyramids built by the background loader, render_volume then finds them without reading the file
+        key = self.image_data_key(filename)
+        self.image_data_cache[key] = volume_proxies[0][1]
+        self.volume_proxies[key] = volume_proxies
+
+    def show_volume_preview(self, filename, image_data):
+        # A preview takes the cell the loaded volume will go to, without advancing the grid
+        if self.next_grid_index >= len(self.all_vtk_widgets):
+            return
+        renderer = self.renderer_list[self.next_grid_index]
+        first_preview = self.preview_filename != filename
+        # Each preview replaces the previous one, so the cell only ever holds the newest preview image
+        self.release_cell(self.next_grid_index)
+        if first_preview:
+            self.release_unused_image_data()
+        mapper_type = self.resolve_volume_mapper()
+        volume = vtkVolume()
+        volume.SetMapper(create_volume_mapper(image_data, self.interactive_sample_distance, mapper_type,
+                                              self.volume_threads, self.auto_sample_distance))
+        volume.SetProperty(self.get_volume_property(self.volume_preset, interactive=True))
+        renderer.AddVolume(volume)
+        self.assign_cell(self.next_grid_index, volume, [image_data], mapper_type=mapper_type)
+        if first_preview:
+            renderer.ResetCamera()
+        self.preview_filename = filename
+        self.render_scheduler.request_render(self.next_grid_index)
+
+    def set_update_rates(self, interactive_update_rate, still_update_rate):
+        self.interactive_update_rate = interactive_update_rate
+        self.still_update_rate = still_update_rate
+        for vtk_widget in self.all_vtk_widgets:
+            interactor = vtk_widget.GetRenderWindow().GetInteractor()
+            if interactor is not None:
+                interactor.SetDesiredUpdateRate(interactive_update_rate)
+                interactor.SetStillUpdateRate(still_update_rate)
+
+    def set_sample_distances(self, still_sample_distance, interactive_sample_distance):
+        # Applies to volumes rendered after the call
+        self.still_sample_distance = still_sample_distance
+        self.interactive_sample_distance = interactive_sample_distance
+
+    def set_volume_mapper(self, mapper_type, number_of_threads=None, auto_sample_distance=None):
+        # Applies to volumes rendered after the call
+        self.volume_mapper = mapper_type
+        if number_of_threads is not None:
+            self.volume_threads = number_of_threads
+        if auto_sample_distance is not None:
+            self.auto_sample_distance = auto_sample_distance
+
+    def resolve_volume_mapper(self):
+        if self.volume_mapper != "auto":
+            return self.volume_mapper
+        # Imported here so the benchmark stack stays out of the window startup
+        from mapper_benchmark import read_mapper_choice, start_mapper_benchmark
+        mapper_type = read_mapper_choice()
+        if mapper_type is not None:
+            return mapper_type
+        if self.mapper_benchmark is None:
+            # First run on this machine: measured once per session in a child process, a driver crash there cannot take the app down
+            self.mapper_benchmark = start_mapper_benchmark()
+        return "smart"
+
+    def set_poly_data(self, poly_data, poly_data_lods=None):
         self.poly_data = poly_data    
+        self.poly_data_lods = poly_data_lods or []
+
+    def show_poly_data(self, poly_data_lods):
+        # Levels are ordered from full resolution to the coarsest decimation
+        self.set_poly_data(poly_data_lods[0], poly_data_lods)
+        self.render_data(data_type="polydata")
+
+    def set_camera_link(self, enabled):
+        # Linked cells share the first cell's vtkCamera; unlinking gives every cell its own copy back
+        self.camera_link = enabled
+        camera = self.renderer_list[0].GetActiveCamera()
+        for renderer in self.renderer_list[1:]:
+            if enabled:
+                renderer.SetActiveCamera(camera)
+            else:
+                own_camera = vtkCamera()
+                own_camera.DeepCopy(camera)
+                renderer.SetActiveCamera(own_camera)
+        self.render_scheduler.request_render()
+
+    def set_frame_overlay(self, enabled):
+        # The text sits on a second renderer layer, so clearing a cell never removes it
+        self.frame_overlay = enabled
+        if enabled and not self.overlay_actors:
+            # Text rendering is only loaded when the overlay is first shown
+            import vtkmodules.vtkRenderingFreeType
+            for vtk_widget in self.all_vtk_widgets:
+                overlay = vtkRenderer()
+                overlay.SetLayer(1)
+                overlay.InteractiveOff()
+                text_actor = vtkTextActor()
+                text_actor.GetTextProperty().SetFontSize(12)
+                text_actor.GetTextProperty().SetColor(1.0, 1.0, 1.0)
+                text_actor.SetDisplayPosition(8, 8)
+                overlay.AddViewProp(text_actor)
+                render_window = vtk_widget.GetRenderWindow()
+                render_window.SetNumberOfLayers(2)
+                render_window.AddRenderer(overlay)
+                self.overlay_actors.append(text_actor)
+        for text_actor in self.overlay_actors:
+            text_actor.SetVisibility(enabled)
+        self.render_scheduler.request_render()
+
+    def frame_summary(self, index):
+        return self.frame_telemetry.summary(index)
+
+    def cell_rendered(self, index):
+        if not self.render_scheduler.flushing:
+            # Frames drawn by the interactor, the user is looking at this cell
+            self.cells[index].last_viewed = time.monotonic()
+        self.frame_telemetry.record(index, self.renderer_list[index].GetLastRenderTimeInSeconds())
+        if self.frame_overlay:
+            # Shows up with the next frame, setting the text does not trigger a render
+            self.overlay_actors[index].SetInput(format_summary(self.frame_telemetry.summary(index)))
+        # A frame drawn by the interactor moved the shared camera, the other cells follow on the next tick
+        if self.camera_link and not self.render_scheduler.flushing:
+            update_rate = self.all_vtk_widgets[index].GetRenderWindow().GetDesiredUpdateRate()
+            for other in range(len(self.all_vtk_widgets)):
+                if other != index:
+                    self.render_scheduler.request_render(other, update_rate)
 
     def initialize_renderers(self):
-        for vtk_widget in self.all_vtk_widgets:
-            renderer = vtk.vtkRenderer()
+        for index, vtk_widget in enumerate(self.all_vtk_widgets):
+            renderer = vtkRenderer()
             renderer.SetBackground(0.2, 0.3, 0.4)  
             render_window = vtk_widget.GetRenderWindow()
             render_window.AddRenderer(renderer)
+            render_window.AddObserver("EndEvent", lambda obj, event, index=index: self.cell_rendered(index))
+            interactor = render_window.GetInteractor()
+            if interactor is not None:
+                # The interactor asks for this rate while rotating and the still rate once released
+                interactor.SetDesiredUpdateRate(self.interactive_update_rate)
+                interactor.SetStillUpdateRate(self.still_update_rate)
             self.renderer_list.append(renderer) 
 
+    def release_cell(self, index):
+        # Textures and buffers are freed while the cell's context is still around, the rest goes with the GridCell
+        render_window = self.all_vtk_widgets[index].GetRenderWindow()
+        for prop in self.cells[index].props:
+            prop.ReleaseGraphicsResources(render_window)
+        self.renderer_list[index].RemoveAllViewProps()
+        self.cells[index] = GridCell()
+
+    def release_unused_image_data(self):
+        # Decoded volumes and pyramids are kept only while a cell shows them or they belong to the current file
+        in_use = {cell.volume_key for cell in self.cells}
+        if self.filename is not None and os.path.exists(self.filename):
+            in_use.add(self.image_data_key(self.filename))
+        for key in [key for key in self.image_data_cache if key not in in_use]:
+            del self.image_data_cache[key]
+        for key in [key for key in self.volume_proxies if key not in in_use]:
+            del self.volume_proxies[key]
+
+    def assign_cell(self, index, prop, image_data=(), poly_data=(), volume_key=None, mapper_type=None):
+        cell = self.cells[index]
+        cell.props.append(prop)
+        cell.image_data.extend(image_data)
+        cell.poly_data.extend(poly_data)
+        cell.volume_key = volume_key
+        cell.mapper_type = mapper_type
+        cell.last_viewed = time.monotonic()
+        self.enforce_memory_budget(keep=index)
+
+    def cell_memory(self, index):
+        return self.cells[index].memory()
+
+    def memory_usage(self):
+        # Per-cell bytes count shared data in every cell showing it, the total counts it once
+        cells = [cell.memory() for cell in self.cells]
+        shared = GridCell()
+        for cell in self.cells:
+            shared.image_data.extend(cell.image_data)
+            shared.poly_data.extend(cell.poly_data)
+        total = shared.memory()
+        # Every cell uploads its own textures, shared images are only deduplicated in host memory
+        total["textures"] = sum(cell["textures"] for cell in cells)
+        total["total"] = total["image_data"] + total["poly_data"] + total["textures"]
+        return {"cells": cells, "total": total, "budget": self.memory_budget}
+
+    def set_memory_budget(self, budget):
+        self.memory_budget = budget
+        self.enforce_memory_budget()
+
+    def enforce_memory_budget(self, keep=None):
+        # Least recently viewed cells are cleared until the grid fits, the cell just filled is never the one evicted
+        if not self.memory_budget:
+            return
+        while self.memory_usage()["total"]["total"] > self.memory_budget:
+            candidates = [index for index, cell in enumerate(self.cells) if cell.props and index != keep]
+            if not candidates:
+                break
+            self.clear_actor_in_grid_index(min(candidates, key=lambda index: self.cells[index].last_viewed))
+
     def clear_actor_in_grid_index(self, index):
         if index < len(self.renderer_list):
-            renderer = self.renderer_list[index]
-            renderer.RemoveAllViewProps()
-            render_window = self.all_vtk_widgets[index].GetRenderWindow()
-            render_window.Render()
+            self.release_cell(index)
+            if index == self.next_grid_index:
+                self.preview_filename = None
+            self.release_unused_image_data()
+            self.render_scheduler.request_render(index)
 
+    @traced("render_volume")
     def render_volume(self):
         if self.next_grid_index < len(self.all_vtk_widgets):
+            # The camera the user set up on the preview is kept for the full volume
+            previewed = self.preview_filename == self.filename
             self.clear_actor_in_grid_index(self.next_grid_index)
             renderer = self.renderer_list[self.next_grid_index]
             if self.filename is None:
                 print("Error: No filename provided.")
                 return
-            reader = vtk.vtkNrrdReader()
-            reader.SetFileName(self.filename)
-            self.colors = vtk.vtkNamedColors()
-            colorTransferFunction = vtk.vtkColorTransferFunction()
-            colorTransferFunction.AddRGBPoint(0, 0.0, 0.0, 0.0)
-            colorTransferFunction.AddRGBPoint(500, 240.0 / 255.0, 184.0 / 255.0, 160.0 / 255.0)
-            colorTransferFunction.AddRGBPoint(1150, 240.0 / 255.0, 184.0 / 255.0, 160.0 / 255.0)
-            colorTransferFunction.AddRGBPoint(1500, 1.0, 1.0, 240.0 / 255.0)
-
-            volumeScalarOpacity = vtk.vtkPiecewiseFunction()
-            volumeScalarOpacity.AddPoint(0, 0.00)
-            volumeScalarOpacity.AddPoint(500, 0.15)
-            volumeScalarOpacity.AddPoint(1150, 0.15)
-            volumeScalarOpacity.AddPoint(1500, 0.85)
-
-            volumeGradientOpacity = vtk.vtkPiecewiseFunction()
-            volumeGradientOpacity.AddPoint(0, 0.0)
-            volumeGradientOpacity.AddPoint(90, 0.5)
-            volumeGradientOpacity.AddPoint(100, 1.0)
-
-            volume_property = vtk.vtkVolumeProperty()
-            volume_property.SetColor(colorTransferFunction)
-            volume_property.SetScalarOpacity(volumeScalarOpacity)
-            volume_property.SetGradientOpacity(volumeGradientOpacity)
-            volume_property.SetInterpolationTypeToLinear()
-            volume_property.ShadeOn()
-            volume_property.SetAmbient(0.4)
-            volume_property.SetDiffuse(0.6)
-            volume_property.SetSpecular(0.2)
-            volume_mapper = vtk.vtkGPUVolumeRayCastMapper()
-            volume_mapper.SetInputConnection(reader.GetOutputPort())
-            volume = vtk.vtkVolume()
-            volume.SetMapper(volume_mapper)
-            volume.SetProperty(volume_property)
+            # Cells showing the same file share one decoded vtkImageData, its proxies and the volume properties
+            volume_proxies = self.load_volume_proxies(self.filename)
+            mapper_type = self.resolve_volume_mapper()
+            volume = create_volume_prop(volume_proxies, self.get_volume_property(self.volume_preset),
+                                        self.get_volume_property(self.volume_preset, interactive=True),
+                                        self.still_sample_distance, self.interactive_sample_distance, mapper_type,
+                                        self.volume_threads, self.auto_sample_distance)
             renderer.AddVolume(volume)
-            self.actor_list.append(volume)
-            renderer.ResetCamera()
-            render_window = self.all_vtk_widgets[self.next_grid_index].GetRenderWindow()
-            render_window.AddRenderer(renderer) 
-            render_window.Render()
+            self.assign_cell(self.next_grid_index, volume, [image_data for _, image_data in volume_proxies],
+                             volume_key=self.image_data_key(self.filename), mapper_type=mapper_type)
+            if not previewed:
+                renderer.ResetCamera()
+            self.render_scheduler.request_render(self.next_grid_index)
         self.next_grid_index = (self.next_grid_index + 1) % len(self.all_vtk_widgets)
 
+    @traced("render_polydata")
     def render_polydata(self):
         if self.next_grid_index < len(self.all_vtk_widgets):
             self.clear_actor_in_grid_index(self.next_grid_index)
@@ -96,13 +528,9 @@ class VolumeRenderer(QFrame):
             if self.poly_data is None:
                 print("Error: No poly data provided.")
                 return
-            mapper = vtk.vtkPolyDataMapper()
-            mapper.SetInputData(self.poly_data)
-            actor = vtk.vtkActor()
-            actor.SetMapper(mapper)
+            actor = create_polydata_actor(self.poly_data_lods or [self.poly_data])
             renderer.AddActor(actor)
-            self.actor_list.append(actor)
+            self.assign_cell(self.next_grid_index, actor, poly_data=self.poly_data_lods or [self.poly_data])
             renderer.ResetCamera()
-            render_window = self.all_vtk_widgets[self.next_grid_index].GetRenderWindow()
-            render_window.Render()
-        self.next_grid_index = (self.next_grid_index + 1) % len(self.all_vtk_widgets)
\ No newline at end of file
+            self.render_scheduler.request_render(self.next_grid_index)
+        self.next_grid_index = (self.next_grid_index + 1) % len(self.all_vtk_widgets)
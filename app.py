@@ -1,16 +1,22 @@
 import os
-from app_logic import AppLogic
+import time
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QMainWindow, QApplication, QGridLayout
-from vtkmodules.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+
+START_TIME = time.perf_counter()
+# Set by benchmarks/bench_startup.py, the app reports its startup markers and quits
+STARTUP_BENCHMARK = os.environ.get("APP_STARTUP_BENCHMARK", "0") not in ("", "0")
 
 class DemoApp(QMainWindow):
     def __init__(self):
         super(DemoApp, self).__init__()
         self.ui = None
+        self.logic = None
+        self.window_shown = False
         self.setup()
 
     def setup(self):
-        # Import the generated UI file using the pyuic5 command| self pointer 
+        # Import the generated UI file using the pyuic5 command| self pointer
         import demo_ui
         self.ui = demo_ui.Ui_MainWindow()
         self.ui.setupUi(self)
@@ -18,6 +24,23 @@ class DemoApp(QMainWindow):
         self.ui.vtk_panel_layout = QGridLayout()
         self.ui.vtk_panel_layout.setContentsMargins(0, 0, 0, 0)
         self.ui.vtk_panel.setLayout(self.ui.vtk_panel_layout)
+        # The VTK widgets and the pipeline are built once the window is on screen
+        self.ui.frame.setEnabled(False)
+
+    def showEvent(self, event):
+        super(DemoApp, self).showEvent(event)
+        if not self.window_shown:
+            self.window_shown = True
+            QTimer.singleShot(0, self.first_window_shown)
+
+    def first_window_shown(self):
+        if STARTUP_BENCHMARK:
+            print(f"first_window {time.perf_counter() - START_TIME:.4f}", flush=True)
+        QTimer.singleShot(0, self.setup_vtk_panel)
+
+    def setup_vtk_panel(self):
+        from vtkmodules.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+        from app_logic import AppLogic
         # Create and add QVTKRenderWindowInteractor widgets to the grid layout
         self.vtk_widgets = []
         for i in range(2):
@@ -26,10 +49,14 @@ class DemoApp(QMainWindow):
                 self.ui.vtk_panel_layout.addWidget(vtk_widget, i, j)
                 self.vtk_widgets.append(vtk_widget)
         self.logic = AppLogic(self.ui, self.vtk_widgets)
+        self.ui.frame.setEnabled(True)
+        if STARTUP_BENCHMARK:
+            print(f"vtk_panel_ready {time.perf_counter() - START_TIME:.4f}", flush=True)
+            QApplication.instance().quit()
 
 if __name__ == "__main__":
     import sys
-    os.chdir(os.path.dirname(__file__))
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
     app = QApplication([])
     main_window = DemoApp()
     main_window.setWindowTitle("CT-Task")
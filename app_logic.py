@@ -1,16 +1,50 @@
 import os
+import importlib
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QFileDialog
-from Rendering import VolumeRenderer
-from data_processing import generate_mask_polydata, write_stl
+from Rendering import VolumeRenderer, build_volume_proxies
+from workers import PipelineTaskManager, VolumeLoader
+from profiling import tracer
 
 OUTPUT_Dir = "output"
+SEGMENT_LABELS = {0: 2.0, 1: 1.0, 2: 7.0, 3: 3.0}
+EXPORT_ALL_FORMATS = ("stl", "ply", "obj", "vtp")
+EXPORT_ALL_ARCHIVE = os.path.join(OUTPUT_Dir, "segments.zip")
+# SimpleITK, NumPy and the meshing stack are imported off the GUI thread after the window is up
+PIPELINE_MODULES = ("numpy", "SimpleITK", "label_index", "data_processing")
+LABEL_INDEX_TASK = ("label_index", "all")
+
+def preload_pipeline_modules():
+    for module_name in PIPELINE_MODULES:
+        importlib.import_module(module_name)
+
+def pipeline():
+    return importlib.import_module("data_processing")
+
+def run_pipeline(function_name, *args):
+    # Resolved on the worker thread, the GUI thread never waits on the import lock held by the preload
+    return getattr(pipeline(), function_name)(*args)
+
+def load_label_values():
+    preload_pipeline_modules()
+    return pipeline().read_label_index()["labels"]
 
 class AppLogic:
     def __init__(self, ui, vtk_widgets):
         self.ui = ui
         self.volume_renderer = VolumeRenderer(vtk_widgets)  
+        self.task_manager = PipelineTaskManager()
+        self.volume_loader = VolumeLoader(prepare=build_volume_proxies)
+        self.volume_load_trace_mark = None
+        # Labels present in the label map, filled in once the preload has read the index
+        self.label_values = None
+        self.label_index_failed = False
         self.setup_ui_connections()
+        self.read_label_values()
+
+    def read_label_values(self):
+        self.label_index_failed = False
+        self.task_manager.submit(LABEL_INDEX_TASK, load_label_values, callback=self.label_values_loaded)
 
     def find_main_window(self):
         parent = self.ui.upload_ct_button
@@ -21,38 +55,118 @@ class AppLogic:
         return None 
   
     def generate_file_paths_label(self, index):
-        segment_labels = {0: 2.0, 1: 1.0, 2: 7.0, 3: 3.0}
-        label_value = segment_labels.get(index, 1.0)
+        label_value = SEGMENT_LABELS.get(index)
+        if label_value is None:
+            label_value = self.label_values[0] if self.label_values else 1.0
         stl_output_file = os.path.join(OUTPUT_Dir, f"output_mesh_{label_value}.stl")
-        output_segment_file = os.path.join(OUTPUT_Dir, f"segment_{label_value}.nrrd")
-        vtp_output_file = os.path.join(OUTPUT_Dir, f"polydata_mesh_{label_value}.vtp")
-        return stl_output_file, output_segment_file, vtp_output_file, label_value      
+        return stl_output_file, label_value      
 
     def setup_ui_connections(self):
         self.ui.upload_ct_button.clicked.connect(self.open_ct_file)
         self.ui.export_stl.clicked.connect(self.export_stl_segment) # only export stl file
+        self.ui.export_all.clicked.connect(self.export_all_segments)
         self.ui.view_segment.clicked.connect(self.view_stl_segment) # TODO: make it only view segment from polydata 
         self.ui.segments_comboBox.currentIndexChanged.connect(self.segment_selection_changed)
+        self.task_manager.task_failed.connect(self.task_failed)
+        self.volume_loader.preview_ready.connect(self.volume_renderer.show_volume_preview)
+        self.volume_loader.progress.connect(self.volume_load_progress)
+        self.volume_loader.loaded.connect(self.volume_loaded)
+        self.volume_loader.failed.connect(self.volume_load_failed)
 
     def open_ct_file(self):
         options = QFileDialog.Options()
         filename, _ = QFileDialog.getOpenFileName(self.find_main_window(), "Open CT File", "", "NRRD Files (*.nrrd)", options=options)
         if filename:
-            self.volume_renderer.set_filename(filename)
-            self.volume_renderer.render_data(data_type="volume")
+            # Decoding runs in the background, a load still in flight for another file is cancelled
+            self.volume_load_trace_mark = tracer.mark()
+            self.ui.statusbar.showMessage(f"Loading {os.path.basename(filename)} ...")
+            self.volume_loader.load(filename)
+
+    def volume_load_progress(self, filename, fraction):
+        self.ui.statusbar.showMessage(f"Loading {os.path.basename(filename)} ... {fraction * 100:.0f}%")
+
+    def volume_loaded(self, filename, volume_proxies):
+        self.volume_renderer.add_volume_proxies(filename, volume_proxies)
+        self.volume_renderer.set_filename(filename)
+        self.volume_renderer.render_data(data_type="volume")
+        self.ui.statusbar.showMessage(f"Loaded {os.path.basename(filename)}")
+        self.show_trace_breakdown(self.volume_load_trace_mark)
+
+    def volume_load_failed(self, filename, message):
+        print(message)
+        self.ui.statusbar.showMessage(f"Failed to load {os.path.basename(filename)}")
 
     def export_stl_segment(self):
-        stl_output_file, output_segment_file, vtp_output_file, label_value = self.generate_file_paths_label(self.ui.segments_comboBox.currentIndex())
-        _,_ = generate_mask_polydata(output_segment_file, vtp_output_file, label_value)
-        write_stl(stl_output_file, vtp_output_file)
+        stl_output_file, label_value = self.generate_file_paths_label(self.ui.segments_comboBox.currentIndex())
+        self.ui.vector_size.setText(f"Exporting {str(self.ui.segments_comboBox.currentText())} ...")
+        trace_mark = tracer.mark()
+        # Meshing is keyed by label so a View already running for the same segment is reused
+        self.task_manager.submit(("mesh", label_value), run_pipeline, "generate_mask_polydata", label_value,
+                                 callback=lambda _: self.task_manager.submit(("stl", label_value), run_pipeline, "write_stl", stl_output_file, label_value,
+                                                                             callback=lambda _: self.stl_exported(stl_output_file, trace_mark)))
+
+    def export_all_segments(self):
+        self.ui.vector_size.setText(f"Exporting all segments as {', '.join(EXPORT_ALL_FORMATS).upper()} ...")
+        trace_mark = tracer.mark()
+        self.task_manager.submit(("export", "all"), run_pipeline, "export_segments", OUTPUT_Dir, None, EXPORT_ALL_FORMATS, EXPORT_ALL_ARCHIVE,
+                                 callback=lambda paths: self.stl_exported(paths[0], trace_mark))
+
+    def stl_exported(self, stl_output_file, trace_mark):
         self.ui.vector_size.setText(f"Exported path: {stl_output_file} ")   
+        self.show_trace_breakdown(trace_mark)
      
     def view_stl_segment(self):
-        _, output_segment_file, vtp_output_file, label_value = self.generate_file_paths_label(self.ui.segments_comboBox.currentIndex())
-        poly_data, physical_size = generate_mask_polydata(output_segment_file, vtp_output_file, label_value)
-        self.ui.vector_size.setText(f"{str(self.ui.segments_comboBox.currentText())} has a surface volume of: {physical_size:.4f} mm^3")
-        self.volume_renderer.set_poly_data(poly_data)
-        self.volume_renderer.render_data(data_type="polydata")
+        _, label_value = self.generate_file_paths_label(self.ui.segments_comboBox.currentIndex())
+        segment_name = str(self.ui.segments_comboBox.currentText())
+        self.ui.vector_size.setText(f"Generating {segment_name} ...")
+        trace_mark = tracer.mark()
+        # Decimated levels and mesh metrics come from the cached full mesh once meshing for the label is done
+        self.task_manager.submit(("mesh", label_value), run_pipeline, "generate_mask_polydata", label_value,
+                                 callback=lambda _: self.task_manager.submit(("lods", label_value), self.load_segment_view, label_value,
+                                                                             callback=lambda result: self.segment_generated(segment_name, result, trace_mark)))
+
+    def load_segment_view(self, label_value):
+        # Runs on a worker thread
+        poly_data_lods, physical_size = pipeline().generate_mask_polydata_lods(label_value)
+        return poly_data_lods, physical_size, pipeline().read_mesh_metrics(label_value)
+
+    def segment_generated(self, segment_name, result, trace_mark):
+        poly_data_lods, physical_size, metrics = result
+        self.ui.vector_size.setText(f"{segment_name} has a voxel volume of: {physical_size:.4f} mm^3\n"
+                                    f"Mesh volume: {abs(metrics['volume']):.4f} mm^3\n"
+                                    f"Surface area: {metrics['surface_area']:.4f} mm^2\n"
+                                    f"Compactness: {metrics['compactness']:.4f}\n"
+                                    f"Boundary / non-manifold edges: {metrics['boundary_edges']} / {metrics['non_manifold_edges']}")
+        self.volume_renderer.poly_data_ready.emit(poly_data_lods)
+        self.show_trace_breakdown(trace_mark)
+
+    def show_trace_breakdown(self, trace_mark):
+        if tracer.enabled:
+            self.ui.statusbar.showMessage(tracer.format_breakdown(tracer.breakdown_since(trace_mark)))
+
+    def task_failed(self, key, message):
+        print(message)
+        if key == LABEL_INDEX_TASK:
+            # Selections stop waiting on the index, the next one asks for it again
+            self.label_index_failed = True
+            self.ui.vector_size.setText(f"{str(self.ui.segments_comboBox.currentText())}: Failed to read the label map")
+            return
+        self.ui.vector_size.setText(f"Failed to process {key[0]} for label {key[1]}")
    
+    def label_values_loaded(self, label_values):
+        self.label_values = label_values
+        if self.ui.vector_size.text().endswith("Reading label map ..."):
+            self.segment_selection_changed()
+
     def segment_selection_changed(self):
+        label_value = SEGMENT_LABELS.get(self.ui.segments_comboBox.currentIndex())
+        if self.label_values is None:
+            # Checked again when the index arrives from the worker; a failed read is retried
+            if self.label_index_failed:
+                self.read_label_values()
+            self.ui.vector_size.setText(f"{str(self.ui.segments_comboBox.currentText())}: Reading label map ...")
+            return
+        if label_value not in self.label_values:
+            self.ui.vector_size.setText(f"{str(self.ui.segments_comboBox.currentText())} is not present in the label map")
+            return
         self.ui.vector_size.setText(f"{str(self.ui.segments_comboBox.currentText())} is ready for [View | Export] actions")
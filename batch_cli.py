@@ -0,0 +1,144 @@
+import os
+import csv
+import sys
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+MASK_SUFFIX = "_CT_Masks.nrrd"
+CT_SUFFIX = "_CT.nrrd"
+# Spacing, origin and direction may differ by this much between a CT and its mask
+GEOMETRY_TOLERANCE = 1e-3
+SEGMENT_FIELDS = ["label", "voxel_count", "physical_volume_mm3", "triangles", "mesh_volume_mm3", "surface_area_mm2", "compactness",
+                  "boundary_edges", "non_manifold_edges", "hu_mean", "hu_std", "hu_min", "hu_max", "mesh_s", "stl_s"]
+
+def find_cases(input_dir):
+    cases = []
+    for name in sorted(os.listdir(input_dir)):
+        if name.endswith(MASK_SUFFIX):
+            case_id = name[:-len(MASK_SUFFIX)]
+            ct_file = os.path.join(input_dir, case_id + CT_SUFFIX)
+            cases.append({"case_id": case_id, "ct": ct_file if os.path.exists(ct_file) else "", "mask": os.path.join(input_dir, name)})
+    return cases
+
+def read_manifest(manifest_file):
+    # Manifest columns: case_id, ct, mask (relative paths are resolved against the manifest)
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    with open(manifest_file, newline="") as f:
+        return [{"case_id": row["case_id"],
+                 "ct": os.path.join(base_dir, row["ct"]) if row.get("ct") else "",
+                 "mask": os.path.join(base_dir, row["mask"])} for row in csv.DictReader(f)]
+
+def init_worker(cache_dir):
+    from pipeline_cache import pipeline_cache
+    pipeline_cache.cache_dir = cache_dir
+
+def check_geometry(ct_geometry, mask_geometry):
+    import numpy as np
+    if list(ct_geometry["size"]) != list(mask_geometry["size"]):
+        raise ValueError(f"CT size {ct_geometry['size']} does not match mask size {mask_geometry['size']}")
+    for field in ("spacing", "origin", "direction"):
+        if not np.allclose(ct_geometry[field], mask_geometry[field], atol=GEOMETRY_TOLERANCE):
+            raise ValueError(f"CT {field} {ct_geometry[field]} does not match mask {field} {mask_geometry[field]}")
+
+def hu_stats(mask, ct_array):
+    import numpy as np
+    values = mask.gather(ct_array)
+    if values.size == 0:
+        return {}
+    return {"hu_mean": f"{values.mean(dtype=np.float64):.2f}", "hu_std": f"{values.std(dtype=np.float64):.2f}",
+            "hu_min": int(values.min()), "hu_max": int(values.max())}
+
+def process_case(case, output_dir, label_values=None, export_stl=True):
+    import data_processing
+    from label_index import label_stats
+    case_dir = os.path.join(output_dir, case["case_id"])
+    os.makedirs(case_dir, exist_ok=True)
+    start = time.perf_counter()
+    volume = data_processing.read_label_map(case["mask"])
+    read_s = time.perf_counter() - start
+    index_start = time.perf_counter()
+    index = data_processing.load_label_index(case["mask"], volume)
+    index_s = time.perf_counter() - index_start
+    if label_values is None:
+        label_values = index["labels"]
+    extract_start = time.perf_counter()
+    masks = data_processing.extract_all_segments(volume, case["mask"], label_values)
+    extract_s = time.perf_counter() - extract_start
+    ct_array = None
+    if case["ct"]:
+        # The CT is only sampled under each mask, a cached CT is read straight from the memmap
+        ct_array, ct_geometry = data_processing.read_nrrd_file(case["ct"])
+        check_geometry(ct_geometry, volume[1])
+    rows = []
+    for label_value in label_values:
+        mesh_start = time.perf_counter()
+        poly_data = data_processing.vtk2polydata(label_value, case["mask"])
+        mesh_s = time.perf_counter() - mesh_start
+        stl_s = 0.0
+        if export_stl:
+            stl_start = time.perf_counter()
+            data_processing.write_stl(os.path.join(case_dir, f"output_mesh_{float(label_value)}.stl"), label_value, case["mask"])
+            stl_s = time.perf_counter() - stl_start
+        stats = label_stats(index, label_value) or {"voxel_count": 0, "physical_volume": 0.0}
+        metrics = data_processing.read_mesh_metrics(label_value, case["mask"])
+        row = {"label": float(label_value), "voxel_count": stats["voxel_count"],
+               "physical_volume_mm3": f"{stats['physical_volume']:.3f}", "triangles": poly_data.GetNumberOfCells(),
+               "mesh_volume_mm3": f"{abs(metrics['volume']):.3f}", "surface_area_mm2": f"{metrics['surface_area']:.3f}",
+               "compactness": f"{metrics['compactness']:.4f}", "boundary_edges": metrics["boundary_edges"],
+               "non_manifold_edges": metrics["non_manifold_edges"], "mesh_s": f"{mesh_s:.3f}", "stl_s": f"{stl_s:.3f}"}
+        if ct_array is not None:
+            row.update(hu_stats(masks[float(label_value)], ct_array))
+        rows.append(row)
+    # Masks and meshes are written asynchronously, wait so the cache is complete when the worker returns
+    data_processing.cache_writer.submit(lambda: None).result()
+    with open(os.path.join(case_dir, "segments.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SEGMENT_FIELDS, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+    data_processing.memory_cache.clear()
+    return {"case_id": case["case_id"], "status": "ok", "labels": len(rows), "read_s": f"{read_s:.3f}",
+            "index_s": f"{index_s:.3f}", "extract_s": f"{extract_s:.3f}", "total_s": f"{time.perf_counter() - start:.3f}"}
+
+def run_cases(cases, output_dir, workers, cache_dir, label_values=None, export_stl=True):
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(cache_dir,)) as executor:
+        futures = {executor.submit(process_case, case, output_dir, label_values, export_stl): case for case in cases}
+        for future in as_completed(futures):
+            case = futures[future]
+            try:
+                result = future.result()
+            except Exception:
+                traceback.print_exc()
+                result = {"case_id": case["case_id"], "status": "failed"}
+            print(f"{result['case_id']}: {result['status']} {result.get('total_s', '')}")
+            results.append(result)
+    fieldnames = ["case_id", "status", "labels", "read_s", "index_s", "extract_s", "total_s"]
+    with open(os.path.join(output_dir, "summary.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, restval="")
+        writer.writeheader()
+        writer.writerows(sorted(results, key=lambda result: result["case_id"]))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute segment volumes, meshes and STLs for CT/mask NRRD pairs")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input-dir", help=f"directory with <case>{CT_SUFFIX} / <case>{MASK_SUFFIX} pairs")
+    source.add_argument("--manifest", help="CSV manifest with case_id, ct and mask columns")
+    parser.add_argument("--output-dir", default=os.path.join("output", "batch"))
+    parser.add_argument("--cache-dir", default=os.path.join("output", "cache"))
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--labels", type=float, nargs="*", help="label values to process (default: every label present)")
+    parser.add_argument("--no-stl", action="store_true", help="skip STL export")
+    args = parser.parse_args(argv)
+    cases = find_cases(args.input_dir) if args.input_dir else read_manifest(args.manifest)
+    if not cases:
+        print("No cases found.")
+        return 1
+    results = run_cases(cases, args.output_dir, args.workers, args.cache_dir, args.labels, not args.no_stl)
+    return 0 if all(result["status"] == "ok" for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import SimpleITK as sitk
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.environ.setdefault("PIPELINE_CACHE_DIR", os.path.join(tempfile.mkdtemp(prefix="bench_cache_"), "cache"))
+
+import data_processing
+from pipeline_cache import pipeline_cache
+from memory_cache import memory_cache
+from label_index import compute_label_index, label_volume
+
+SIZES = {
+    "128": (128, 128, 128),
+    "256": (256, 256, 256),
+    "512x512x600": (512, 512, 600),
+}
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+REFERENCE_LABEL_MAP = os.path.join(ROOT_DIR, "volume Rendering", "CT_Masks.nrrd")
+REFERENCE_SOFT_TISSUE_LABEL = 7.0
+REFERENCE_SOFT_TISSUE_VOLUME = 165896.015
+ABSOLUTE_SLACK_S = 0.01
+# Peak RSS is gated by default, it does not move with machine load the way wall-clock time does
+RSS_SLACK_MB = 32.0
+
+def synthetic_label_map(size, label_count, spacing=(0.5, 0.5, 1.0)):
+    # Nested ellipsoids, label 1 is the outer shell and the highest label the core
+    z, y, x = np.ogrid[:size[2], :size[1], :size[0]]
+    radius = ((x - size[0] / 2) / (size[0] / 2)) ** 2 + ((y - size[1] / 2) / (size[1] / 2)) ** 2 + ((z - size[2] / 2) / (size[2] / 2)) ** 2
+    labels = np.zeros((size[2], size[1], size[0]), dtype=np.float32)
+    for label in range(1, label_count + 1):
+        labels[radius < (1.0 - (label - 1) / (label_count + 1)) ** 2 * 0.9] = label
+    image = sitk.GetImageFromArray(labels)
+    image.SetSpacing(spacing)
+    return image
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def reset_caches():
+    data_processing.cache_writer.submit(lambda: None).result()
+    pipeline_cache.clear()
+    memory_cache.clear()
+
+def bench_case(label_map_file, size_name, label_count, work_dir):
+    results = {}
+    voxels = int(np.prod(SIZES[size_name]))
+    label_value = 1.0
+    reset_caches()
+    for mode in ("cold", "warm"):
+        volume, read_s = timed(data_processing.read_nrrd_file, label_map_file) if mode == "cold" else timed(data_processing.read_label_map, label_map_file)
+        memory_cache.put(("label_map", pipeline_cache.file_hash(label_map_file)), volume)
+        mask, extract_s = timed(data_processing.extract_segment, volume, label_value, label_map_file)
+        _, size_s = timed(data_processing.compute_physical_size, mask)
+        poly_data, mesh_s = timed(data_processing.vtk2polydata, label_value, label_map_file)
+        _, stl_s = timed(data_processing.write_stl, os.path.join(work_dir, "bench.stl"), label_value, label_map_file)
+        triangles = poly_data.GetNumberOfCells()
+        stages = {"read_nrrd_file": read_s, "extract_segment": extract_s, "compute_physical_size": size_s,
+                  "vtk2polydata": mesh_s, "write_stl": stl_s}
+        for stage, seconds in stages.items():
+            results[f"{size_name}/{label_count}/{stage}/{mode}"] = {
+                "seconds": seconds,
+                "voxels_per_s": voxels / seconds if seconds > 0 else float("inf"),
+                "triangles_per_s": triangles / seconds if seconds > 0 and stage in ("vtk2polydata", "write_stl") else None,
+            }
+    results[f"{size_name}/{label_count}/peak_rss_mb"] = {"seconds": None, "peak_rss_mb": peak_rss_mb()}
+    return results
+
+def label_map_path(work_dir, size_name, label_count):
+    return os.path.join(work_dir, f"labels_{size_name}_{label_count}.nrrd")
+
+def write_label_map(size_name, label_count, work_dir):
+    data_processing.write_segment(label_map_path(work_dir, size_name, label_count), synthetic_label_map(SIZES[size_name], label_count))
+
+def run_case(size_name, label_count, work_dir):
+    # Runs in a fresh process per case, so peak RSS belongs to this case and not to the largest one before it
+    # or to building the synthetic label map, which gets a process of its own
+    label_map_file = label_map_path(work_dir, size_name, label_count)
+    try:
+        return bench_case(label_map_file, size_name, label_count, work_dir)
+    finally:
+        reset_caches()
+
+def check_reference_volume():
+    if not os.path.exists(REFERENCE_LABEL_MAP):
+        print(f"Reference label map not found: {REFERENCE_LABEL_MAP}")
+        return True
+    # The volumes the app reports: the label index (sidecar and freshly computed) and the run-length mask
+    reset_caches()
+    volumes = {
+        "generate_mask_polydata": data_processing.generate_mask_polydata(REFERENCE_SOFT_TISSUE_LABEL, REFERENCE_LABEL_MAP)[1],
+        "compute_label_index": label_volume(compute_label_index(data_processing.read_nrrd_file(REFERENCE_LABEL_MAP)), REFERENCE_SOFT_TISSUE_LABEL),
+        "load_segment": data_processing.load_segment(REFERENCE_SOFT_TISSUE_LABEL, REFERENCE_LABEL_MAP).physical_volume(),
+    }
+    reset_caches()
+    ok = True
+    for source, volume in volumes.items():
+        matches = abs(volume - REFERENCE_SOFT_TISSUE_VOLUME) < 1e-3
+        ok = ok and matches
+        print(f"Soft tissue volume ({source}): {volume:.3f} mm^3 (reference {REFERENCE_SOFT_TISSUE_VOLUME} mm^3) {'OK' if matches else 'MISMATCH'}")
+    return ok
+
+def compare_to_baseline(results, baseline, tolerance, rss_tolerance):
+    # Returns (slowdowns, memory regressions); wall-clock numbers depend on the machine, so slowdowns are only reported
+    slowdowns, regressions = [], []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        if result.get("seconds") is None:
+            if baseline[name].get("peak_rss_mb") is None:
+                continue
+            limit = baseline[name]["peak_rss_mb"] * (1.0 + rss_tolerance) + RSS_SLACK_MB
+            if result["peak_rss_mb"] > limit:
+                regressions.append(f"{name}: {result['peak_rss_mb']:.1f} MB > {limit:.1f} MB")
+            continue
+        # The absolute slack keeps millisecond-scale warm stages from flagging timer noise
+        limit = baseline[name]["seconds"] * (1.0 + tolerance) + ABSOLUTE_SLACK_S
+        if result["seconds"] > limit:
+            slowdowns.append(f"{name}: {result['seconds']:.4f}s > {limit:.4f}s")
+    return slowdowns, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the data_processing pipeline on synthetic label maps")
+    parser.add_argument("--sizes", nargs="*", default=["128", "256"], choices=list(SIZES))
+    parser.add_argument("--labels", type=int, nargs="*", default=[1, 4, 8])
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="slowdown relative to the baseline that is reported (0.5 = 50%%)")
+    parser.add_argument("--rss-tolerance", type=float, default=0.2, help="allowed peak RSS growth relative to the baseline (0.2 = 20%%)")
+    parser.add_argument("--fail-on-slowdown", action="store_true", help="exit non-zero on wall-clock slowdowns too, for runs on the baseline machine")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", help="write the full results as JSON")
+    args = parser.parse_args(argv)
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    results = {}
+    try:
+        with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+            for size_name in args.sizes:
+                for label_count in args.labels:
+                    executor.submit(write_label_map, size_name, label_count, work_dir).result()
+                    results.update(executor.submit(run_case, size_name, label_count, work_dir).result())
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    for name, result in results.items():
+        if result.get("seconds") is None:
+            print(f"{name:60s} {result['peak_rss_mb']:10.1f} MB")
+        else:
+            triangles = f"{result['triangles_per_s']:.3e} tri/s" if result["triangles_per_s"] else ""
+            print(f"{name:60s} {result['seconds']:10.4f} s {result['voxels_per_s']:.3e} vox/s {triangles}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    ok = check_reference_volume()
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({name: {"seconds": result["seconds"]} if result.get("seconds") is not None else {"peak_rss_mb": result["peak_rss_mb"]}
+                       for name, result in results.items()}, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            slowdowns, regressions = compare_to_baseline(results, json.load(f), args.tolerance, args.rss_tolerance)
+        for slowdown in slowdowns:
+            print(f"{'REGRESSION' if args.fail_on_slowdown else 'SLOWER'} {slowdown}")
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        ok = ok and not regressions and not (args.fail_on_slowdown and slowdowns)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.environ.setdefault("PIPELINE_CACHE_DIR", os.path.join(tempfile.mkdtemp(prefix="bench_cache_"), "cache"))
+
+from Rendering import (DEFAULT_VOLUME_PRESET, INTERACTIVE_UPDATE_RATE, STILL_UPDATE_RATE, VOLUME_MAPPERS, VOLUME_PRESETS,
+                       build_volume_proxies, create_polydata_actor, create_volume_prop, create_volume_property)
+from frame_telemetry import FrameTelemetry, format_summary
+from snapshot_service import offscreen_window
+
+REFERENCE_LABEL_MAP = os.path.join(ROOT_DIR, "volume Rendering", "CT_Masks.nrrd")
+REFERENCE_LABEL = 7.0
+
+def load_prop(args):
+    # Same props the grid builds: the proxy pyramid for a CT, the decimated LODs for a segment mesh
+    if args.ct:
+        from raw_volume import read_raw_vtk_image
+        volume_proxies = build_volume_proxies(read_raw_vtk_image(args.ct))
+        preset = VOLUME_PRESETS[DEFAULT_VOLUME_PRESET]
+        return create_volume_prop(volume_proxies, create_volume_property(preset), create_volume_property(preset, interactive=True),
+                                  mapper_type=args.mapper, number_of_threads=args.threads, auto_sample_distance=args.auto_sample_distance)
+    import data_processing
+    poly_data_lods, _ = data_processing.generate_mask_polydata_lods(args.label, args.mask)
+    return create_polydata_actor(poly_data_lods)
+
+def orbit(prop, frames, size, update_rate, log_file=None):
+    render_window, renderer = offscreen_window(size)
+    renderer.RemoveAllViewProps()
+    renderer.AddViewProp(prop)
+    renderer.ResetCamera()
+    render_window.SetDesiredUpdateRate(update_rate)
+    telemetry = FrameTelemetry(1, log_file or "")
+    # The first frame uploads textures and compiles shaders, it is reported on its own
+    start = time.perf_counter()
+    render_window.Render()
+    first_frame_s = time.perf_counter() - start
+    camera = renderer.GetActiveCamera()
+    start = time.perf_counter()
+    for _ in range(frames):
+        camera.Azimuth(360.0 / frames)
+        camera.OrthogonalizeViewUp()
+        render_window.Render()
+        telemetry.record(0, renderer.GetLastRenderTimeInSeconds())
+    wall_s = time.perf_counter() - start
+    telemetry.close()
+    renderer.RemoveAllViewProps()
+    return dict(telemetry.summary(0), first_frame_ms=first_frame_s * 1000, wall_s=wall_s)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Orbit the camera around a CT volume or segment mesh offscreen and report frame times")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--ct", help="CT NRRD to volume render")
+    source.add_argument("--mask", default=REFERENCE_LABEL_MAP, help="label map whose segment mesh is rendered")
+    parser.add_argument("--label", type=float, default=REFERENCE_LABEL)
+    parser.add_argument("--frames", type=int, default=180)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--mapper", default="gpu", choices=list(VOLUME_MAPPERS))
+    parser.add_argument("--threads", type=int, default=0, help="CPU ray cast threads (0 = one per core)")
+    parser.add_argument("--auto-sample-distance", action="store_true", help="let the mapper coarsen sampling to meet the update rate")
+    parser.add_argument("--interactive", action="store_true", help="render at the interactive update rate, so proxies and LODs are used")
+    parser.add_argument("--log", help="per-frame CSV log")
+    parser.add_argument("--output", help="append the summary as a JSON line")
+    args = parser.parse_args(argv)
+    update_rate = INTERACTIVE_UPDATE_RATE if args.interactive else STILL_UPDATE_RATE
+    result = orbit(load_prop(args), args.frames, args.size, update_rate, args.log)
+    result.update(source=args.ct or f"{args.mask}:{args.label}", mapper=args.mapper if args.ct else "polydata",
+                  threads=args.threads, auto_sample_distance=args.auto_sample_distance, update_rate=update_rate, size=args.size)
+    print(format_summary(result))
+    print(f"first frame {result['first_frame_ms']:.1f} ms  max {result['max_ms']:.1f} ms  {result['frames']} frames in {result['wall_s']:.2f} s")
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
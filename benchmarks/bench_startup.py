@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAX_FIRST_WINDOW_S = 1.0
+
+def run_once():
+    env = dict(os.environ, APP_STARTUP_BENCHMARK="1")
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, "app.py")], cwd=ROOT_DIR, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    markers = {}
+    for line in process.stdout:
+        name, _, _ = line.partition(" ")
+        if name in ("first_window", "vtk_panel_ready"):
+            # Wall clock from spawning the interpreter, so Python and Qt startup are included
+            markers[name] = time.perf_counter() - start
+    process.wait(timeout=60)
+    return markers
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure time to first window of app.py")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-first-window", type=float, default=MAX_FIRST_WINDOW_S)
+    args = parser.parse_args(argv)
+    runs = [run_once() for _ in range(args.runs)]
+    ok = True
+    for marker in ("first_window", "vtk_panel_ready"):
+        samples = [run[marker] for run in runs if marker in run]
+        if not samples:
+            print(f"{marker}: not reported")
+            ok = False
+            continue
+        print(f"{marker}: median {statistics.median(samples):.3f} s  min {min(samples):.3f} s  max {max(samples):.3f} s")
+    first_window = [run["first_window"] for run in runs if "first_window" in run]
+    if first_window and statistics.median(first_window) > args.max_first_window:
+        print(f"FAIL time to first window above {args.max_first_window:.2f} s")
+        ok = False
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,73 +1,350 @@
 import os
-import vtk
-import itk
+import json
+import math
+import shutil
+import numpy as np
 import SimpleITK as sitk
+from concurrent.futures import ThreadPoolExecutor
+from vtkmodules.util import numpy_support
+from vtkmodules.vtkCommonDataModel import vtkImageData, vtkPolyData
+from vtkmodules.vtkFiltersCore import vtkMarchingCubes, vtkMassProperties, vtkQuadricClustering
+from vtkmodules.vtkIOXML import vtkXMLPolyDataReader, vtkXMLPolyDataWriter
+from label_index import load_label_index, label_volume, label_stats
+from pipeline_cache import pipeline_cache
+from memory_cache import memory_cache
+from mask_rle import RunLengthMask, encode_label, mask_from_runs, read_rle_mask, runs_from_array, runs_from_indices, write_rle_mask
+from raw_volume import RAW_CACHE_ENABLED, array_to_vtk, index_to_physical, padded_bounds, raw_volume_key, write_raw_array
+from volume_loader import load_volume
+from surface_extraction import extract_label_surfaces
+from mesh_export import DEFAULT_EXPORT_FORMATS, export_meshes, export_stl, shallow_copy_polydata
+from mesh_metrics import compute_all_mesh_metrics, compute_mesh_metrics
+from profiling import tracer, traced
 
 input_image_file = "volume Rendering/CT_Masks.nrrd"
 
+SEGMENT_PARAMS = {"format": "rle"}
+MESH_PARAMS = {"isovalue": 1.0, "crop_padding": 1}
+STL_PARAMS = {"binary": True}
+LOD_LEVELS = (1.0, 0.25, 0.05)
+MULTI_LABEL_MESH_PARAMS = {"engine": "discrete_flying_edges", "crop_padding": 1}
+# Segment/mesh files are a cache side effect written off the meshing path, never a prerequisite for it
+WRITE_CACHE_FILES = True
+cache_writer = ThreadPoolExecutor(max_workers=1)
+
+def write_cache_file_async(key, suffix, write_file):
+    if WRITE_CACHE_FILES:
+        return cache_writer.submit(pipeline_cache.put, key, suffix, write_file)
+
+def segment_cache_key(label_value, label_map_file=input_image_file):
+    return pipeline_cache.key(label_map_file, "segment", label=float(label_value), **SEGMENT_PARAMS)
+
+def mesh_cache_key(label_value, label_map_file=input_image_file):
+    return pipeline_cache.key(label_map_file, "mesh", label=float(label_value), **SEGMENT_PARAMS, **MESH_PARAMS)
+
+def multi_label_mesh_cache_key(label_value, label_map_file=input_image_file):
+    return pipeline_cache.key(label_map_file, "mesh", label=float(label_value), **MULTI_LABEL_MESH_PARAMS)
+
+def lod_cache_key(label_value, level, label_map_file=input_image_file):
+    return pipeline_cache.key(label_map_file, "mesh_lod", label=float(label_value), level=level, **SEGMENT_PARAMS, **MESH_PARAMS)
+
+def stl_cache_key(label_value, label_map_file=input_image_file):
+    return pipeline_cache.key(label_map_file, "stl", label=float(label_value), **SEGMENT_PARAMS, **MESH_PARAMS, **STL_PARAMS)
+
 def compute_physical_size(extracted_region):
+    if isinstance(extracted_region, RunLengthMask):
+        return extracted_region.physical_volume()
     physical_size = sitk.GetArrayFromImage(extracted_region).sum() * extracted_region.GetSpacing()[0] * extracted_region.GetSpacing()[1] * extracted_region.GetSpacing()[2]
     return physical_size
 
-def generate_mask_polydata(output_segment_file, vtp_output_file, label_value=1.0):
-    poly_data = vtk2polydata(output_segment_file, label_value, vtp_output_file)
-    extracted_region = read_nrrd_file(output_segment_file) 
-    physical_size = compute_physical_size(extracted_region)
+@traced("generate_mask_polydata")
+def generate_mask_polydata(label_value=1.0, label_map_file=input_image_file):
+    poly_data = vtk2polydata(label_value, label_map_file)
+    # Volume comes from the label index sidecar instead of re-reading the segment voxels
+    physical_size = label_volume(read_label_index(label_map_file), label_value)
     return poly_data, physical_size
 
-def write_stl(stl_output_file, vtp_output_file):
-    if not os.path.exists(stl_output_file):
-        reader = read_polydata_file(vtp_output_file)
-        stl_writer = vtk.vtkSTLWriter()
-        stl_writer.SetFileName(stl_output_file)
-        stl_writer.SetFileTypeToBinary()  # Set STL writer to binary mode (small file size)
-        stl_writer.SetInputData(reader)
-        stl_writer.Write()    
-
-def extract_segment(output_segment_file, image, label_value):
-    if not os.path.exists(output_segment_file):
-        extracted_region = sitk.BinaryThreshold(image, lowerThreshold=label_value, upperThreshold=label_value)
-        # Write Compressed NRRD file form  70MB to 1.5MB
-        writer = sitk.ImageFileWriter()
-        writer.SetFileName(output_segment_file)
-        writer.UseCompressionOn()
-        writer.Execute(extracted_region)
+@traced("generate_mask_polydata_lods")
+def generate_mask_polydata_lods(label_value=1.0, label_map_file=input_image_file, levels=LOD_LEVELS):
+    poly_data, physical_size = generate_mask_polydata(label_value, label_map_file)
+    lods = []
+    for level in levels:
+        if level >= 1.0:
+            lods.append(poly_data)
+            continue
+        key = lod_cache_key(label_value, level, label_map_file)
+        lod = memory_cache.get(("mesh", key))
+        if lod is None:
+            lod = pipeline_cache.load(key, ".vtp", read_polydata_file)
+            if lod is None:
+                lod = decimate_polydata(poly_data, level)
+                write_cache_file_async(key, ".vtp", lambda path, snapshot=shallow_copy_polydata(lod): write_polydata_file(path, snapshot))
+            memory_cache.put(("mesh", key), lod)
+        lods.append(lod)
+    return lods, physical_size
+
+@traced("decimate")
+def decimate_polydata(poly_data, level):
+    if poly_data.GetNumberOfCells() == 0:
+        return poly_data
+    # Quadric clustering is a single linear pass; the grid spacing grows with 1/sqrt(level)
+    # because the triangle count of a surface scales with the square of its resolution
+    mass_properties = vtkMassProperties()
+    mass_properties.SetInputData(shallow_copy_polydata(poly_data))
+    mass_properties.Update()
+    edge_length = math.sqrt(2.0 * mass_properties.GetSurfaceArea() / poly_data.GetNumberOfCells())
+    division_spacing = edge_length / math.sqrt(level)
+    bounds = poly_data.GetBounds()
+    clustering = vtkQuadricClustering()
+    clustering.SetInputData(shallow_copy_polydata(poly_data))
+    clustering.AutoAdjustNumberOfDivisionsOff()
+    clustering.SetNumberOfDivisions(*[max(int(math.ceil((bounds[2 * axis + 1] - bounds[2 * axis]) / division_spacing)), 2) for axis in range(3)])
+    clustering.Update()
+    decimated = vtkPolyData()
+    decimated.ShallowCopy(clustering.GetOutput())
+    return decimated
+
+@traced("generate_all_mask_polydata")
+def generate_all_mask_polydata(label_values=None, label_map_file=input_image_file, number_of_threads=0):
+    index = read_label_index(label_map_file)
+    if label_values is None:
+        label_values = index["labels"]
+    poly_data_by_label = {}
+    missing_labels = []
+    for label_value in label_values:
+        key = multi_label_mesh_cache_key(label_value, label_map_file)
+        poly_data = memory_cache.get(("mesh", key))
+        if poly_data is None:
+            poly_data = pipeline_cache.load(key, ".vtp", read_polydata_file)
+            if poly_data is not None:
+                memory_cache.put(("mesh", key), poly_data)
+        if poly_data is None:
+            missing_labels.append(float(label_value))
+        else:
+            poly_data_by_label[float(label_value)] = poly_data
+    if missing_labels:
+        volume = read_label_map(label_map_file)
+        bounding_boxes = [stats["bounding_box"] for stats in (label_stats(index, label_value) for label_value in missing_labels) if stats]
+        if bounding_boxes:
+            lower = np.min([bounding_box[0] for bounding_box in bounding_boxes], axis=0)
+            upper = np.max([bounding_box[1] for bounding_box in bounding_boxes], axis=0)
+            volume = crop_to_bounding_box(volume, (lower, upper), MULTI_LABEL_MESH_PARAMS["crop_padding"])
+        array, geometry = volume
+        vtk_image = array_to_vtk(np.ascontiguousarray(array), geometry)
+        surfaces = extract_label_surfaces(vtk_image, missing_labels, number_of_threads)
+        del vtk_image
+        for label_value, poly_data in surfaces.items():
+            key = multi_label_mesh_cache_key(label_value, label_map_file)
+            write_cache_file_async(key, ".vtp", lambda path, snapshot=shallow_copy_polydata(poly_data): write_polydata_file(path, snapshot))
+            poly_data_by_label[label_value] = memory_cache.put(("mesh", key), poly_data)
+    return {label_value: (poly_data_by_label[float(label_value)], label_volume(index, label_value)) for label_value in label_values}
+
+@traced("export_segments")
+def export_segments(output_dir, label_values=None, formats=DEFAULT_EXPORT_FORMATS, archive_file=None, label_map_file=input_image_file):
+    # Meshes are handed to the writers from memory, every missing label is contoured in one pass
+    meshes = generate_all_mask_polydata(label_values, label_map_file)
+    return export_meshes({label_value: poly_data for label_value, (poly_data, _) in meshes.items()}, output_dir, formats, archive_file)
+
+@traced("write_stl")
+def write_stl(stl_output_file, label_value, label_map_file=input_image_file):
+    key = stl_cache_key(label_value, label_map_file)
+    # The export location is always refreshed from the cache so it matches the loaded label map
+    if pipeline_cache.load(key, ".stl", lambda path: shutil.copyfile(path, stl_output_file)) is None:
+        poly_data = vtk2polydata(label_value, label_map_file)
+        shutil.copyfile(pipeline_cache.put(key, ".stl", lambda path: export_stl(path, shallow_copy_polydata(poly_data))), stl_output_file)
+
+@traced("threshold")
+def extract_segment(volume, label_value, label_map_file=input_image_file):
+    key = segment_cache_key(label_value, label_map_file)
+    extracted_region = memory_cache.get(("segment", key))
+    if extracted_region is not None:
         return extracted_region
+    extracted_region = pipeline_cache.load(key, ".rle", read_rle_mask)
+    if extracted_region is None:
+        extracted_region = encode_label(volume, label_value)
+        write_cache_file_async(key, ".rle", lambda path: write_rle_mask(path, extracted_region))
+    return memory_cache.put(("segment", key), extracted_region)
+
+@traced("split_label_masks")
+def split_label_masks(volume, label_values=None):
+    # Sort only the foreground voxel indices once, every label's runs then come from a contiguous slice
+    labels, geometry = volume
+    labels = labels.ravel()
+    foreground = np.flatnonzero(labels)
+    foreground_labels = labels[foreground]
+    order = np.argsort(foreground_labels, kind="stable")
+    foreground = foreground[order]
+    values, starts, counts = np.unique(foreground_labels[order], return_index=True, return_counts=True)
+    runs = {float(value): (start, start + count) for value, start, count in zip(values, starts, counts)}
+    if label_values is None:
+        label_values = list(runs)
+    masks = {}
+    for label_value in label_values:
+        label_value = float(label_value)
+        if label_value == 0:
+            starts, lengths = runs_from_array(labels == 0)
+        else:
+            start, end = runs.get(label_value, (0, 0))
+            # The stable sort keeps each label's voxel indices ascending
+            starts, lengths = runs_from_indices(foreground[start:end])
+        masks[label_value] = mask_from_runs(geometry, starts, lengths)
+    return masks
+
+@traced("nrrd_write")
+def write_segment(output_segment_file, extracted_region):
+    # Write Compressed NRRD file form  70MB to 1.5MB
+    writer = sitk.ImageFileWriter()
+    writer.SetFileName(output_segment_file)
+    writer.SetUseCompression(True)
+    writer.Execute(extracted_region)
+
+def extract_all_segments(volume, label_map_file=input_image_file, label_values=None):
+    masks = split_label_masks(volume, label_values)
+    for label_value, extracted_region in masks.items():
+        key = segment_cache_key(label_value, label_map_file)
+        memory_cache.put(("segment", key), extracted_region)
+        if pipeline_cache.get(key, ".rle") is None:
+            write_cache_file_async(key, ".rle", lambda path, extracted_region=extracted_region: write_rle_mask(path, extracted_region))
+    return masks
+
+@traced("load_segment")
+def load_segment(label_value, label_map_file=input_image_file):
+    key = segment_cache_key(label_value, label_map_file)
+    extracted_region = memory_cache.get(("segment", key))
+    if extracted_region is not None:
+        return extracted_region
+    extracted_region = pipeline_cache.load(key, ".rle", read_rle_mask)
+    if extracted_region is not None:
+        return memory_cache.put(("segment", key), extracted_region)
+    volume = read_label_map(label_map_file)
+    load_label_index(label_map_file, volume)
+    # Decode the label map once and split every label's mask in the same pass
+    masks = extract_all_segments(volume, label_map_file)
+    if float(label_value) not in masks:
+        return extract_segment(volume, label_value, label_map_file)
+    return memory_cache.put(("segment", key), masks[float(label_value)])
+
+@traced("crop")
+def crop_to_bounding_box(volume, bounding_box, padding=1):
+    # A view into the (z, y, x) array, the origin moves with the crop so the mesh stays in world coordinates
+    array, geometry = volume
+    lower, upper = padded_bounds(bounding_box, geometry["size"], padding)
+    cropped = array[lower[2]:upper[2], lower[1]:upper[1], lower[0]:upper[0]]
+    return cropped, dict(geometry, size=[upper[axis] - lower[axis] for axis in range(3)], origin=index_to_physical(geometry, lower))
+
+@traced("vtk_conversion")
+def sitk_to_vtk_image(image):
+    # Wrap the SimpleITK pixel buffer without copying, the caller keeps the image alive while the vtkImageData is used
+    array = sitk.GetArrayViewFromImage(image)
+    if image.GetNumberOfComponentsPerPixel() == 1:
+        vtk_array = numpy_support.numpy_to_vtk(array.reshape(-1), deep=False)
     else:
-        return read_nrrd_file(output_segment_file)
-
-def vtk2polydata(output_segment_file, label_value, vtp_output_file):
-    if not os.path.exists(vtp_output_file):
-        if not os.path.exists(output_segment_file):
-            image = read_nrrd_file(input_image_file)
-            _ = extract_segment(output_segment_file, image, label_value)
-        itk_image = itk.imread(output_segment_file)
-        vtk_image = itk.vtk_image_from_image(itk_image)
-        marching_cubes = vtk.vtkMarchingCubes()
+        vtk_array = numpy_support.numpy_to_vtk(array.reshape(-1, image.GetNumberOfComponentsPerPixel()), deep=False)
+    vtk_image = vtkImageData()
+    vtk_image.SetDimensions(image.GetSize())
+    vtk_image.SetSpacing(image.GetSpacing())
+    vtk_image.SetOrigin(image.GetOrigin())
+    vtk_image.SetDirectionMatrix(image.GetDirection())
+    vtk_image.GetPointData().SetScalars(vtk_array)
+    return vtk_image
+
+@traced("vtk2polydata")
+def vtk2polydata(label_value, label_map_file=input_image_file):
+    key = mesh_cache_key(label_value, label_map_file)
+    poly_data = memory_cache.get(("mesh", key))
+    if poly_data is not None:
+        return poly_data
+    poly_data = pipeline_cache.load(key, ".vtp", read_polydata_file)
+    if poly_data is not None:
+        return memory_cache.put(("mesh", key), poly_data)
+    stats = label_stats(read_label_index(label_map_file), label_value)
+    # Only the label's bounding box is expanded from the runs into a dense mask
+    extracted_region = load_segment(label_value, label_map_file).to_image(stats["bounding_box"] if stats else None, MESH_PARAMS["crop_padding"])
+    vtk_image = sitk_to_vtk_image(extracted_region)
+    with tracer.span("marching_cubes"):
+        marching_cubes = vtkMarchingCubes()
         marching_cubes.SetInputData(vtk_image)
-        marching_cubes.SetValue(0, 1.0)
+        marching_cubes.SetValue(0, MESH_PARAMS["isovalue"])
         marching_cubes.Update()
-        poly_data = vtk.vtkPolyData()
-        poly_data.ShallowCopy(marching_cubes.GetOutput())
-        writer = vtk.vtkXMLPolyDataWriter()
-        writer.SetFileName(vtp_output_file)
-        writer.SetInputData(poly_data)
-        writer.Write()
-        return poly_data
-    else:
-        return read_polydata_file(vtp_output_file)
+    poly_data = vtkPolyData()
+    poly_data.ShallowCopy(marching_cubes.GetOutput())
+    # Release the VTK views before the SimpleITK buffer they point into
+    del marching_cubes, vtk_image
+    # Metrics are computed on first read by read_mesh_metrics, meshing for export never pays for them
+    write_cache_file_async(key, ".vtp", lambda path, snapshot=shallow_copy_polydata(poly_data): write_polydata_file(path, snapshot))
+    return memory_cache.put(("mesh", key), poly_data)
+
+def cache_mesh_metrics(mesh_key, metrics):
+    # Metrics live next to the mesh they describe, under the same cache key
+    write_cache_file_async(mesh_key, ".metrics.json", lambda path: write_json_file(path, metrics))
+    return memory_cache.put(("metrics", mesh_key), metrics)
 
+def cached_mesh_metrics(mesh_key):
+    metrics = memory_cache.get(("metrics", mesh_key))
+    if metrics is None:
+        metrics = pipeline_cache.load(mesh_key, ".metrics.json", read_json_file)
+        if metrics is not None:
+            memory_cache.put(("metrics", mesh_key), metrics)
+    return metrics
+
+@traced("read_mesh_metrics")
+def read_mesh_metrics(label_value, label_map_file=input_image_file):
+    key = mesh_cache_key(label_value, label_map_file)
+    metrics = cached_mesh_metrics(key)
+    if metrics is None:
+        metrics = cache_mesh_metrics(key, compute_mesh_metrics(vtk2polydata(label_value, label_map_file)))
+    return metrics
+
+@traced("read_all_mesh_metrics")
+def read_all_mesh_metrics(label_values=None, label_map_file=input_image_file):
+    meshes = generate_all_mask_polydata(label_values, label_map_file)
+    metrics = {label_value: cached_mesh_metrics(multi_label_mesh_cache_key(label_value, label_map_file)) for label_value in meshes}
+    missing = {label_value: meshes[label_value][0] for label_value, label_metrics in metrics.items() if label_metrics is None}
+    # Every label without cached metrics goes through one vectorized pass
+    for label_value, label_metrics in compute_all_mesh_metrics(missing).items():
+        metrics[label_value] = cache_mesh_metrics(multi_label_mesh_cache_key(label_value, label_map_file), label_metrics)
+    return metrics
+
+def read_json_file(path):
+    with open(path) as f:
+        return json.load(f)
+
+def write_json_file(path, value):
+    with open(path, "w") as f:
+        json.dump(value, f)
+
+@traced("label_index")
+def read_label_index(label_map_file=input_image_file):
+    return memory_cache.get_or_load(("label_index", pipeline_cache.file_hash(label_map_file)), lambda: load_label_index(label_map_file))
+
+def read_label_map(label_map_file=input_image_file):
+    return memory_cache.get_or_load(("label_map", pipeline_cache.file_hash(label_map_file)), lambda: read_nrrd_file(label_map_file))
+
+@traced("nrrd_decode")
 def read_nrrd_file(filename):
-    reader = sitk.ImageFileReader()
-    reader.SetImageIO("NrrdImageIO")
-    reader.SetFileName(filename)
-    image = reader.Execute()
-    return image
+    # Returns (array, geometry); a raw cache hit is the memmap itself, array_to_sitk is left to SimpleITK filters
+    array, geometry, cached = load_volume(filename)
+    if not cached and RAW_CACHE_ENABLED and WRITE_CACHE_FILES:
+        # The uncompressed copy is written off the read path, later opens skip the gzip inflate
+        cache_writer.submit(write_raw_array, raw_volume_key(filename), array, geometry)
+    return array, geometry
 
+@traced("vtp_read")
 def read_polydata_file(vtp_output_file):
-    reader = vtk.vtkXMLPolyDataReader()
-    reader.SetFileName(vtp_output_file)
+    # Read through Python so a missing (evicted) file raises FileNotFoundError instead of yielding an empty mesh;
+    # once open the data stays readable even if the entry is removed
+    with open(vtp_output_file, "rb") as f:
+        data = f.read()
+    reader = vtkXMLPolyDataReader()
+    reader.ReadFromInputStringOn()
+    reader.SetInputString(data)
     reader.Update()
-    poly_data = vtk.vtkPolyData()
+    poly_data = vtkPolyData()
     poly_data.ShallowCopy(reader.GetOutput())
     return poly_data
+
+@traced("vtp_write")
+def write_polydata_file(vtp_output_file, poly_data):
+    writer = vtkXMLPolyDataWriter()
+    writer.SetFileName(vtp_output_file)
+    writer.SetInputData(shallow_copy_polydata(poly_data))
+    writer.Write()
@@ -51,6 +51,9 @@ class Ui_MainWindow(object):
         self.export_stl = QtWidgets.QPushButton(self.frame)
         self.export_stl.setObjectName("export_stl")
         self.verticalLayout.addWidget(self.export_stl)
+        self.export_all = QtWidgets.QPushButton(self.frame)
+        self.export_all.setObjectName("export_all")
+        self.verticalLayout.addWidget(self.export_all)
         spacerItem1 = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
         self.verticalLayout.addItem(spacerItem1)
         self.label_2 = QtWidgets.QLabel(self.frame)
@@ -95,6 +98,7 @@ class Ui_MainWindow(object):
         self.segments_comboBox.setItemText(3, _translate("MainWindow", "Teeth"))
         self.view_segment.setText(_translate("MainWindow", "View Segment "))
         self.export_stl.setText(_translate("MainWindow", "Export Segment STL"))
+        self.export_all.setText(_translate("MainWindow", "Export All Segments"))
         self.label_2.setText(_translate("MainWindow", "Status"))
         self.vector_size.setText(_translate("MainWindow", "<No Segment Selected>"))
 
@@ -0,0 +1,80 @@
+import os
+import math
+import time
+import atexit
+import threading
+from collections import deque
+
+FRAME_OVERLAY_ENABLED = os.environ.get("RENDER_FRAME_OVERLAY", "0") not in ("", "0")
+# Per-frame CSV log (time_s, cell, render_ms), off when empty
+FRAME_LOG_FILE = os.environ.get("RENDER_FRAME_LOG", "")
+# Percentiles and FPS are taken over the most recent frames of each cell
+FRAME_WINDOW = 600
+
+class FrameStats:
+    def __init__(self, window=FRAME_WINDOW):
+        self.render_times = deque(maxlen=window)
+        self.frame_ends = deque(maxlen=window)
+        self.frame_count = 0
+
+    def add(self, render_time, timestamp=None):
+        self.render_times.append(render_time)
+        self.frame_ends.append(time.perf_counter() if timestamp is None else timestamp)
+        self.frame_count += 1
+
+    def percentile(self, q):
+        # Nearest rank, so every reported value is a frame that actually happened
+        if not self.render_times:
+            return 0.0
+        ordered = sorted(self.render_times)
+        return ordered[max(1, math.ceil(q / 100.0 * len(ordered))) - 1]
+
+    def fps(self):
+        if len(self.frame_ends) < 2 or self.frame_ends[-1] <= self.frame_ends[0]:
+            return 0.0
+        return (len(self.frame_ends) - 1) / (self.frame_ends[-1] - self.frame_ends[0])
+
+    def summary(self):
+        return {"frames": self.frame_count, "last_ms": self.render_times[-1] * 1000 if self.render_times else 0.0,
+                "fps": self.fps(), "p50_ms": self.percentile(50) * 1000, "p95_ms": self.percentile(95) * 1000,
+                "p99_ms": self.percentile(99) * 1000, "max_ms": max(self.render_times, default=0.0) * 1000}
+
+    def clear(self):
+        self.render_times.clear()
+        self.frame_ends.clear()
+        self.frame_count = 0
+
+def format_summary(summary):
+    return (f"{summary['fps']:.1f} fps  last {summary['last_ms']:.1f} ms\n"
+            f"p50 {summary['p50_ms']:.1f}  p95 {summary['p95_ms']:.1f}  p99 {summary['p99_ms']:.1f} ms")
+
+class FrameTelemetry:
+    def __init__(self, cell_count, log_file=FRAME_LOG_FILE):
+        self.stats = [FrameStats() for _ in range(cell_count)]
+        self.log_file = log_file
+        self.log = None
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def record(self, index, render_time):
+        timestamp = time.perf_counter()
+        self.stats[index].add(render_time, timestamp)
+        if self.log_file:
+            with self.lock:
+                if self.log is None:
+                    os.makedirs(os.path.dirname(self.log_file) or ".", exist_ok=True)
+                    self.log = open(self.log_file, "a", buffering=1)
+                    # Sessions append to the same log, the header only goes at the top of the file
+                    if self.log.tell() == 0:
+                        self.log.write("time_s,cell,render_ms\n")
+                    atexit.register(self.close)
+                self.log.write(f"{timestamp - self.origin:.6f},{index},{render_time * 1000:.3f}\n")
+
+    def summary(self, index):
+        return self.stats[index].summary()
+
+    def close(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
@@ -0,0 +1,92 @@
+import os
+import json
+import numpy as np
+from raw_volume import index_to_physical
+from profiling import traced
+
+INDEX_VERSION = 1
+
+def label_index_path(input_image_file):
+    return f"{input_image_file}.labels.json"
+
+@traced("compute_label_index")
+def compute_label_index(volume):
+    # volume is the (array, geometry) pair read_nrrd_file returns, the array may be a read-only memmap
+    labels, geometry = volume
+    shape = labels.shape
+    flat_labels = labels.ravel()
+    foreground = np.flatnonzero(flat_labels)
+    values, inverse, counts = np.unique(flat_labels[foreground], return_inverse=True, return_counts=True)
+    # Array axes are (z, y, x), the index is reported in image (x, y, z) order
+    zyx = np.unravel_index(foreground, shape)
+    xyz = [zyx[2], zyx[1], zyx[0]]
+    voxel_volume = float(np.prod(geometry["spacing"]))
+    sums = np.stack([np.bincount(inverse, weights=axis, minlength=len(values)) for axis in xyz], axis=1)
+    mins = np.full((len(values), 3), np.iinfo(np.int64).max, dtype=np.int64)
+    maxs = np.full((len(values), 3), -1, dtype=np.int64)
+    for axis, coords in enumerate(xyz):
+        np.minimum.at(mins[:, axis], inverse, coords)
+        np.maximum.at(maxs[:, axis], inverse, coords)
+    index = {
+        "version": INDEX_VERSION,
+        "size": list(geometry["size"]),
+        "spacing": list(geometry["spacing"]),
+        "origin": list(geometry["origin"]),
+        "direction": list(geometry["direction"]),
+        "labels": [float(value) for value in values],
+        "stats": {},
+    }
+    for i, value in enumerate(values):
+        centroid_index = (sums[i] / counts[i]).tolist()
+        index["stats"][str(float(value))] = {
+            "voxel_count": int(counts[i]),
+            "physical_volume": int(counts[i]) * voxel_volume,
+            "bounding_box": [mins[i].tolist(), maxs[i].tolist()],
+            "centroid": index_to_physical(geometry, centroid_index),
+        }
+    return index
+
+def _source_signature(input_image_file):
+    stat = os.stat(input_image_file)
+    return {"mtime": stat.st_mtime, "bytes": stat.st_size}
+
+def save_label_index(input_image_file, index):
+    index = dict(index, source=_source_signature(input_image_file))
+    path = label_index_path(input_image_file)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
+    return index
+
+def read_saved_label_index(input_image_file):
+    # The sidecar if it is current, None when the label map has to be decoded
+    path = label_index_path(input_image_file)
+    if os.path.exists(path):
+        with open(path) as f:
+            index = json.load(f)
+        if index.get("version") == INDEX_VERSION and index.get("source") == _source_signature(input_image_file):
+            return index
+    return None
+
+def load_label_index(input_image_file, volume=None):
+    index = read_saved_label_index(input_image_file)
+    if index is not None:
+        return index
+    if volume is None:
+        from volume_loader import load_volume
+        array, geometry, _ = load_volume(input_image_file)
+        volume = (array, geometry)
+    index = compute_label_index(volume)
+    try:
+        return save_label_index(input_image_file, index)
+    except OSError:
+        # Read-only case directories still get the statistics, just without the sidecar
+        return index
+
+def label_stats(index, label_value):
+    return index["stats"].get(str(float(label_value)))
+
+def label_volume(index, label_value):
+    stats = label_stats(index, label_value)
+    return stats["physical_volume"] if stats else 0.0
@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+import statistics
+import subprocess
+
+MAPPER_CHOICE_FILE = os.environ.get("RENDER_MAPPER_CHOICE_FILE", os.path.join("output", "volume_mapper.json"))
+BENCHMARK_MAPPERS = ("gpu", "cpu")
+BENCHMARK_VOLUME_SIZE = 128
+BENCHMARK_WINDOW_SIZE = 384
+BENCHMARK_FRAMES = 12
+# A backend is dropped from further frames once one frame takes longer than this, software GL would otherwise run for minutes
+FRAME_BUDGET_MS = 1000.0
+
+def machine_signature():
+    from vtkmodules.vtkCommonCore import vtkVersion
+    # A new machine, core count or VTK build invalidates the stored choice
+    return {"node": platform.node(), "cpus": os.cpu_count(), "vtk": vtkVersion.GetVTKVersion()}
+
+def read_mapper_choice(choice_file=MAPPER_CHOICE_FILE):
+    try:
+        with open(choice_file) as f:
+            choice = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if choice.get("machine") != machine_signature():
+        return None
+    return choice.get("mapper")
+
+def start_mapper_benchmark(choice_file=MAPPER_CHOICE_FILE):
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--output", choice_file],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Reaped as soon as it exits, the app never has to poll it
+    threading.Thread(target=process.wait, daemon=True).start()
+    return process
+
+def synthetic_volume(size=BENCHMARK_VOLUME_SIZE):
+    # Soft tissue ellipsoid with a bone core, so every transfer function segment is sampled
+    import numpy as np
+    from raw_volume import RAW_FORMAT_VERSION, array_to_vtk
+    z, y, x = np.ogrid[:size, :size, :size]
+    radius = ((x - size / 2) ** 2 + (y - size / 2) ** 2 * 1.5 + (z - size / 2) ** 2) / (size / 2) ** 2
+    array = np.full((size, size, size), -1000, dtype=np.int16)
+    array[radius < 0.8] = 40
+    array[radius < 0.2] = 1200
+    geometry = {"version": RAW_FORMAT_VERSION, "size": [size] * 3, "spacing": [1.0, 1.0, 1.0], "origin": [0.0, 0.0, 0.0],
+                "direction": [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0], "components": 1}
+    return array_to_vtk(array, geometry)
+
+def time_mapper(mapper_type, image_data, frames=BENCHMARK_FRAMES, size=BENCHMARK_WINDOW_SIZE, number_of_threads=0, frame_budget_ms=FRAME_BUDGET_MS):
+    from Rendering import DEFAULT_VOLUME_PRESET, STILL_UPDATE_RATE, VOLUME_PRESETS, create_volume_prop, create_volume_property
+    from snapshot_service import offscreen_window
+    render_window, renderer = offscreen_window(size)
+    volume_property = create_volume_property(VOLUME_PRESETS[DEFAULT_VOLUME_PRESET])
+    volume = create_volume_prop([(1, image_data)], volume_property, volume_property, mapper_type=mapper_type,
+                                number_of_threads=number_of_threads)
+    if mapper_type == "gpu" and not volume.GetMapper().IsRenderSupported(render_window, volume_property):
+        return None
+    renderer.RemoveAllViewProps()
+    renderer.AddVolume(volume)
+    renderer.ResetCamera()
+    render_window.SetDesiredUpdateRate(STILL_UPDATE_RATE)
+    # The first frame uploads textures and compiles shaders, only the steady state decides, unless the first frame is already over budget
+    start = time.perf_counter()
+    render_window.Render()
+    frame_times = [time.perf_counter() - start]
+    if frame_times[0] * 1000 <= frame_budget_ms:
+        frame_times = []
+        for _ in range(frames):
+            renderer.GetActiveCamera().Azimuth(360.0 / frames)
+            start = time.perf_counter()
+            render_window.Render()
+            frame_times.append(time.perf_counter() - start)
+            if frame_times[-1] * 1000 > frame_budget_ms:
+                break
+    renderer.RemoveAllViewProps()
+    return statistics.median(frame_times) * 1000
+
+def run_benchmark(mappers=BENCHMARK_MAPPERS, frames=BENCHMARK_FRAMES, size=BENCHMARK_WINDOW_SIZE, number_of_threads=0,
+                  frame_budget_ms=FRAME_BUDGET_MS):
+    image_data = synthetic_volume()
+    frame_ms = {}
+    for mapper_type in mappers:
+        try:
+            frame_ms[mapper_type] = time_mapper(mapper_type, image_data, frames, size, number_of_threads, frame_budget_ms)
+        except Exception:
+            frame_ms[mapper_type] = None
+    measured = {mapper_type: ms for mapper_type, ms in frame_ms.items() if ms is not None}
+    # Smart mode decides at render time when nothing could be measured
+    mapper = min(measured, key=measured.get) if measured else "smart"
+    return {"machine": machine_signature(), "mapper": mapper, "frame_ms": frame_ms}
+
+def write_choice(choice_file, choice):
+    os.makedirs(os.path.dirname(choice_file) or ".", exist_ok=True)
+    tmp_file = f"{choice_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(choice, f, indent=2)
+    os.replace(tmp_file, choice_file)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time every volume mapper backend on this machine and store the fastest")
+    parser.add_argument("--output", default=MAPPER_CHOICE_FILE)
+    parser.add_argument("--frames", type=int, default=BENCHMARK_FRAMES)
+    parser.add_argument("--size", type=int, default=BENCHMARK_WINDOW_SIZE)
+    parser.add_argument("--threads", type=int, default=0, help="CPU ray cast threads (0 = one per core)")
+    parser.add_argument("--frame-budget-ms", type=float, default=FRAME_BUDGET_MS, help="stop timing a backend after a frame slower than this")
+    args = parser.parse_args(argv)
+    choice = run_benchmark(frames=args.frames, size=args.size, number_of_threads=args.threads, frame_budget_ms=args.frame_budget_ms)
+    write_choice(args.output, choice)
+    for mapper_type, ms in choice["frame_ms"].items():
+        print(f"{mapper_type:6s} {'unsupported' if ms is None else f'{ms:.1f} ms/frame'}")
+    print(f"fastest: {choice['mapper']} (written to {args.output})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
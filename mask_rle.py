@@ -0,0 +1,149 @@
+import json
+import zlib
+import struct
+import numpy as np
+import SimpleITK as sitk
+from raw_volume import index_to_physical, padded_bounds
+from profiling import traced
+
+MAGIC = b"RLEMASK1"
+HEADER_LENGTH = struct.Struct("<I")
+COMPRESSION_LEVEL = 6
+# Voxels compared against the label per step when encoding, bounds the temporary mask and index arrays
+ENCODE_CHUNK_VOXELS = 1 << 24
+
+class RunLengthMask:
+    # Foreground runs along the flattened (z, y, x) voxel order, x is the fastest axis
+    def __init__(self, size, spacing, origin, direction, starts, lengths):
+        self.size = tuple(int(n) for n in size)
+        self.spacing = tuple(float(s) for s in spacing)
+        self.origin = tuple(float(o) for o in origin)
+        self.direction = tuple(float(d) for d in direction)
+        self.starts = starts
+        self.lengths = lengths
+
+    @property
+    def nbytes(self):
+        return self.starts.nbytes + self.lengths.nbytes
+
+    def voxel_count(self):
+        return int(self.lengths.sum(dtype=np.int64))
+
+    def physical_volume(self):
+        return self.voxel_count() * float(np.prod(self.spacing))
+
+    def gather(self, array):
+        # Values of a same-sized (z, y, x) array under the mask, in voxel order, without expanding the mask
+        lengths = self.lengths.astype(np.int64)
+        offsets = np.repeat(self.starts.astype(np.int64) - (np.cumsum(lengths) - lengths), lengths)
+        return array.reshape(-1)[offsets + np.arange(offsets.size)]
+
+    @property
+    def geometry(self):
+        return {"size": list(self.size), "spacing": list(self.spacing), "origin": list(self.origin), "direction": list(self.direction)}
+
+    def to_array(self, z_range=None):
+        nx, ny, nz = self.size
+        z0, z1 = z_range or (0, nz)
+        slab_start, slab_end = z0 * nx * ny, z1 * nx * ny
+        # Only the runs touching the requested slab are expanded, clipped to its first and last voxel
+        first = max(np.searchsorted(self.starts, slab_start, side="right") - 1, 0)
+        last = np.searchsorted(self.starts, slab_end, side="left")
+        starts = self.starts[first:last].astype(np.int64)
+        ends = starts + self.lengths[first:last]
+        starts = np.maximum(starts, slab_start) - slab_start
+        ends = np.minimum(ends, slab_end) - slab_start
+        keep = ends > starts
+        # +1 where a run starts and -1 past its end, the running sum taken in place is the mask, one byte per voxel
+        markers = np.zeros(slab_end - slab_start + 1, dtype=np.int8)
+        markers[starts[keep]] += 1
+        markers[ends[keep]] -= 1
+        mask = np.cumsum(markers, out=markers)[:-1].view(np.uint8)
+        return mask.reshape(z1 - z0, ny, nx)
+
+    @traced("rle_decode")
+    def to_image(self, bounding_box=None, padding=0):
+        if bounding_box is None:
+            lower, upper = (0, 0, 0), self.size
+        else:
+            lower, upper = padded_bounds(bounding_box, self.size, padding)
+        array = self.to_array((lower[2], upper[2]))[:, lower[1]:upper[1], lower[0]:upper[0]]
+        image = sitk.GetImageFromArray(np.ascontiguousarray(array))
+        image.SetSpacing(self.spacing)
+        image.SetOrigin(index_to_physical(self.geometry, lower))
+        image.SetDirection(self.direction)
+        return image
+
+def runs_from_indices(indices):
+    # Sorted flat voxel indices to (start, length) runs
+    if len(indices) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    starts = indices[np.concatenate(([0], breaks))]
+    ends = indices[np.concatenate((breaks - 1, [len(indices) - 1]))] + 1
+    return starts, ends - starts
+
+def merge_touching_runs(starts, lengths):
+    # Runs split at a chunk boundary are joined back into one
+    ends = starts + lengths
+    continued = np.flatnonzero(ends[:-1] == starts[1:]) + 1
+    if len(continued) == 0:
+        return starts, lengths
+    first = np.ones(len(starts), dtype=bool)
+    first[continued] = False
+    group_starts = np.flatnonzero(first)
+    group_ends = ends[np.concatenate((group_starts[1:] - 1, [len(starts) - 1]))]
+    return starts[group_starts], group_ends - starts[group_starts]
+
+def runs_from_array(mask):
+    flat = np.ascontiguousarray(mask).reshape(-1).astype(bool, copy=False)
+    edges = np.flatnonzero(np.diff(flat.view(np.int8), prepend=0, append=0))
+    return edges[0::2], edges[1::2] - edges[0::2]
+
+def index_dtype(size):
+    return np.uint32 if int(np.prod(size)) < 2 ** 32 else np.uint64
+
+def mask_from_runs(geometry, starts, lengths):
+    dtype = index_dtype(geometry["size"])
+    return RunLengthMask(geometry["size"], geometry["spacing"], geometry["origin"], geometry["direction"],
+                         starts.astype(dtype), lengths.astype(dtype))
+
+@traced("rle_encode")
+def encode_label(volume, label_value):
+    # Runs straight from the label map a chunk at a time, the full-volume binary mask is never materialized
+    labels, geometry = volume
+    flat = labels.ravel()
+    chunk_starts, chunk_lengths = [], []
+    for offset in range(0, flat.size, ENCODE_CHUNK_VOXELS):
+        starts, lengths = runs_from_indices(np.flatnonzero(flat[offset:offset + ENCODE_CHUNK_VOXELS] == label_value))
+        chunk_starts.append(starts + offset)
+        chunk_lengths.append(lengths)
+    starts, lengths = merge_touching_runs(np.concatenate(chunk_starts), np.concatenate(chunk_lengths))
+    return mask_from_runs(geometry, starts, lengths)
+
+@traced("rle_write")
+def write_rle_mask(path, mask):
+    # Starts are stored as gaps after the previous run, the small deltas compress several times better
+    ends = mask.starts.astype(np.int64) + mask.lengths
+    gaps = mask.starts.astype(np.int64) - np.concatenate(([0], ends[:-1]))
+    payload = zlib.compress(np.concatenate((gaps, mask.lengths)).astype(mask.starts.dtype).tobytes(), COMPRESSION_LEVEL)
+    header = json.dumps({"size": mask.size, "spacing": mask.spacing, "origin": mask.origin, "direction": mask.direction,
+                         "runs": len(mask.starts), "dtype": np.dtype(mask.starts.dtype).name}).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        f.write(payload)
+
+@traced("rle_read")
+def read_rle_mask(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a run-length mask file: {path}")
+        header = json.loads(f.read(HEADER_LENGTH.unpack(f.read(HEADER_LENGTH.size))[0]))
+        runs = np.frombuffer(zlib.decompress(f.read()), dtype=header["dtype"])
+    gaps, lengths = runs[:header["runs"]], runs[header["runs"]:]
+    # Each start is the previous run's end plus its gap
+    ends = np.cumsum(gaps.astype(np.int64) + lengths)
+    starts = (ends - lengths).astype(gaps.dtype)
+    return RunLengthMask(header["size"], header["spacing"], header["origin"], header["direction"], starts, lengths)
@@ -0,0 +1,67 @@
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+def estimate_nbytes(value):
+    if hasattr(value, "GetActualMemorySize"):
+        # vtkDataObject reports kibibytes
+        return value.GetActualMemorySize() * 1024
+    if hasattr(value, "GetNumberOfPixels") and hasattr(value, "GetSizeOfPixelComponent"):
+        return value.GetNumberOfPixels() * value.GetNumberOfComponentsPerPixel() * value.GetSizeOfPixelComponent()
+    if hasattr(value, "nbytes"):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_nbytes(item) for item in value)
+    return 0
+
+class MemoryLRUCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value):
+        nbytes = estimate_nbytes(value)
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return value
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_nbytes) = self.entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+        return value
+
+    def get_or_load(self, key, load):
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, load())
+        return value
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.nbytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+memory_cache = MemoryLRUCache(int(os.environ.get("MEMORY_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)))
@@ -0,0 +1,76 @@
+import math
+import numpy as np
+from vtkmodules.util import numpy_support
+from vtkmodules.vtkFiltersCore import vtkTriangleFilter
+from profiling import traced
+
+EMPTY_METRICS = {"triangles": 0, "surface_area": 0.0, "volume": 0.0, "compactness": 0.0, "boundary_edges": 0, "non_manifold_edges": 0}
+
+def triangle_arrays(poly_data):
+    # Contour and decimation output is all triangles already, anything else is triangulated first
+    polys = poly_data.GetPolys()
+    offsets = numpy_support.vtk_to_numpy(polys.GetOffsetsArray())
+    if poly_data.GetNumberOfCells() != polys.GetNumberOfCells() or np.any(np.diff(offsets) != 3):
+        triangle_filter = vtkTriangleFilter()
+        triangle_filter.SetInputData(poly_data)
+        triangle_filter.Update()
+        poly_data = triangle_filter.GetOutput()
+        polys = poly_data.GetPolys()
+    if poly_data.GetNumberOfPoints() == 0 or polys.GetNumberOfCells() == 0:
+        return np.empty((0, 3)), np.empty((0, 3), dtype=np.int64)
+    points = numpy_support.vtk_to_numpy(poly_data.GetPoints().GetData()).astype(np.float64)
+    triangles = numpy_support.vtk_to_numpy(polys.GetConnectivityArray()).reshape(-1, 3).astype(np.int64)
+    return points, triangles
+
+@traced("mesh_metrics")
+def compute_all_mesh_metrics(poly_data_by_label):
+    # Every mesh is stacked into one triangle array, per-label sums are bincounts over a triangle label index
+    labels = list(poly_data_by_label)
+    all_points, all_triangles, triangle_labels, point_labels = [], [], [], []
+    point_offset = 0
+    for label_index, label_value in enumerate(labels):
+        points, triangles = triangle_arrays(poly_data_by_label[label_value])
+        all_points.append(points)
+        all_triangles.append(triangles + point_offset)
+        triangle_labels.append(np.full(len(triangles), label_index, dtype=np.int64))
+        point_labels.append(np.full(len(points), label_index, dtype=np.int64))
+        point_offset += len(points)
+    if point_offset == 0:
+        return {label_value: dict(EMPTY_METRICS) for label_value in labels}
+    points = np.concatenate(all_points)
+    triangles = np.concatenate(all_triangles)
+    triangle_labels = np.concatenate(triangle_labels)
+    point_labels = np.concatenate(point_labels)
+    a, b, c = points[triangles[:, 0]], points[triangles[:, 1]], points[triangles[:, 2]]
+    cross = np.cross(b - a, c - a)
+    areas = 0.5 * np.linalg.norm(cross, axis=1)
+    # Divergence theorem: each triangle adds the signed volume a.(b x c) / 6 of its tetrahedron with the origin,
+    # and a.((b - a) x (c - a)) is the same product so the area cross product is reused
+    signed_volumes = np.einsum("ij,ij->i", a, cross) / 6.0
+    # Edges are keyed by their (lower, higher) point ids; point ids never repeat across labels
+    edge_keys = np.concatenate([np.minimum(triangles[:, i], triangles[:, j]) * point_offset + np.maximum(triangles[:, i], triangles[:, j])
+                                for i, j in ((0, 1), (1, 2), (2, 0))])
+    edge_keys, edge_counts = np.unique(edge_keys, return_counts=True)
+    edge_labels = point_labels[edge_keys // point_offset]
+    count = len(labels)
+    triangle_counts = np.bincount(triangle_labels, minlength=count)
+    surface_areas = np.bincount(triangle_labels, weights=areas, minlength=count)
+    volumes = np.bincount(triangle_labels, weights=signed_volumes, minlength=count)
+    boundary_edges = np.bincount(edge_labels[edge_counts == 1], minlength=count)
+    non_manifold_edges = np.bincount(edge_labels[edge_counts > 2], minlength=count)
+    metrics = {}
+    for label_index, label_value in enumerate(labels):
+        area, volume = float(surface_areas[label_index]), float(volumes[label_index])
+        metrics[label_value] = {
+            "triangles": int(triangle_counts[label_index]),
+            "surface_area": area,
+            "volume": volume,
+            # Sphericity, 1.0 for a sphere and smaller for any other shape of the same volume
+            "compactness": math.pi ** (1.0 / 3.0) * (6.0 * abs(volume)) ** (2.0 / 3.0) / area if area > 0 else 0.0,
+            "boundary_edges": int(boundary_edges[label_index]),
+            "non_manifold_edges": int(non_manifold_edges[label_index]),
+        }
+    return metrics
+
+def compute_mesh_metrics(poly_data):
+    return compute_all_mesh_metrics({0: poly_data})[0]
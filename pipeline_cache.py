@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+import threading
+
+DEFAULT_CACHE_DIR = os.path.join("output", "cache")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# Cache file names start with the hex SHA-256 key, everything after it is the suffix
+KEY_LENGTH = 64
+# Eviction frees down to this fraction of the cap, so a full cache is not rescanned on every write
+EVICT_TO_FRACTION = 0.9
+
+class PipelineCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.file_hashes = {}
+        self.index = None
+        self.index_dir = None
+        self.total_bytes = 0
+
+    def file_hash(self, filename):
+        stat = os.stat(filename)
+        signature = (os.path.realpath(filename), stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if signature in self.file_hashes:
+                return self.file_hashes[signature]
+        digest = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        with self.lock:
+            self.file_hashes[signature] = digest.hexdigest()
+        return self.file_hashes[signature]
+
+    def key(self, input_file, stage, **params):
+        payload = json.dumps({"input": self.file_hash(input_file), "stage": stage, "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def stat_key(self, input_file, stage, **params):
+        # Keyed by path, size and mtime like the label index sidecar, nothing is read from the file
+        stat = os.stat(input_file)
+        signature = [os.path.realpath(input_file), stat.st_mtime_ns, stat.st_size]
+        payload = json.dumps({"source": signature, "stage": stage, "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path(self, key, suffix):
+        return os.path.join(self.cache_dir, key[:2], f"{key}{suffix}")
+
+    def get(self, key, suffix):
+        path = self.path(key, suffix)
+        try:
+            # Touching the entry keeps the mtime order equal to the LRU order
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except PermissionError:
+            # Written by another user in a shared cache: still readable, it just keeps its place in the LRU order
+            pass
+        with self.lock:
+            if self.index is not None and path in self.index:
+                self.index[path] = self.index.pop(path)
+        return path
+
+    def load(self, key, suffix, read_file):
+        # Eviction (from the cache writer thread or another process) can remove an entry between get and
+        # the read; read_file must raise FileNotFoundError for a missing file, which is then a plain miss
+        path = self.get(key, suffix)
+        if path is None:
+            return None
+        try:
+            return read_file(path)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, suffix, write_file):
+        path = self.path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Writers pick the file format from the extension, so the suffix is kept on the temporary name
+        tmp_path = os.path.join(os.path.dirname(path), f".{key}.{os.getpid()}.{threading.get_ident()}.tmp{suffix}")
+        try:
+            write_file(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        size = os.path.getsize(path)
+        with self.lock:
+            self.load_index()
+            self.total_bytes += size - self.index.pop(path, 0)
+            self.index[path] = size
+            over_budget = self.total_bytes > self.max_bytes
+        if over_budget:
+            self.evict(keep=path)
+        return path
+
+    def entries(self):
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def load_index(self):
+        # Sizes in LRU order, scanned once per process and kept up to date by put/get/evict; caller holds the lock
+        if self.index is None or self.index_dir != self.cache_dir:
+            self.index_dir = self.cache_dir
+            self.index = {path: size for _, size, path in sorted(self.entries())}
+            self.total_bytes = sum(self.index.values())
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        with self.lock:
+            # Only reached once the tracked size crosses the cap; the rescan also sees files other processes wrote
+            self.index = None
+            self.load_index()
+            # Files of one key (a raw volume's .json header and .npy) are removed together, in the order of their newest use
+            groups, last_use = {}, {}
+            for rank, path in enumerate(self.index):
+                group = os.path.basename(path)[:KEY_LENGTH]
+                groups.setdefault(group, []).append(path)
+                last_use[group] = rank
+            keep_group = os.path.basename(keep)[:KEY_LENGTH] if keep else None
+            for group, paths in sorted(groups.items(), key=lambda item: last_use[item[0]]):
+                if self.total_bytes <= self.max_bytes * EVICT_TO_FRACTION:
+                    break
+                if group == keep_group:
+                    continue
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    self.total_bytes -= self.index.pop(path)
+
+    def clear(self):
+        with self.lock:
+            for _, _, path in self.entries():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.index = None
+
+pipeline_cache = PipelineCache(os.environ.get("PIPELINE_CACHE_DIR", DEFAULT_CACHE_DIR),
+                               int(os.environ.get("PIPELINE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)))
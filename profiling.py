@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import atexit
+import functools
+import threading
+from collections import deque
+
+TRACE_ENABLED = os.environ.get("PIPELINE_TRACE", "0") not in ("", "0")
+TRACE_FILE = os.environ.get("PIPELINE_TRACE_FILE", os.path.join("output", "trace.json"))
+MAX_EVENTS = 100000
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.child_time = 0.0
+        self.tracer.stack().append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        stack = self.tracer.stack()
+        stack.pop()
+        if stack:
+            stack[-1].child_time += duration
+        self.tracer.record(self.name, self.start, duration, duration - self.child_time, self.args)
+        return False
+
+class Tracer:
+    def __init__(self, enabled=TRACE_ENABLED, trace_file=TRACE_FILE):
+        self.enabled = enabled
+        self.trace_file = trace_file
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.event_count = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = time.perf_counter()
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def span(self, name, **args):
+        # Disabled tracing hands back one shared no-op context manager
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def record(self, name, start, duration, self_duration, args):
+        with self.lock:
+            self.events.append((name, start, duration, self_duration, threading.get_ident(), args))
+            self.event_count += 1
+
+    def mark(self):
+        with self.lock:
+            return self.event_count
+
+    def breakdown_since(self, mark):
+        # Self time per span name, so nested stages are not counted twice
+        with self.lock:
+            recent = list(self.events)[-(self.event_count - mark):] if self.event_count > mark else []
+        totals = {}
+        for name, _, _, self_duration, _, _ in recent:
+            totals[name] = totals.get(name, 0.0) + self_duration
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+    def format_breakdown(self, breakdown, limit=6):
+        return " | ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in breakdown[:limit])
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+        return {"traceEvents": [{"name": name, "ph": "X", "pid": pid, "tid": tid,
+                                 "ts": (start - self.origin) * 1e6, "dur": duration * 1e6, "args": args}
+                                for name, start, duration, _, tid, args in events],
+                "displayTimeUnit": "ms"}
+
+    def write_trace(self, trace_file=None):
+        trace_file = trace_file or self.trace_file
+        os.makedirs(os.path.dirname(trace_file) or ".", exist_ok=True)
+        with open(trace_file, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        return trace_file
+
+def traced(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+tracer = Tracer()
+if tracer.enabled:
+    atexit.register(tracer.write_trace)
@@ -0,0 +1,100 @@
+import os
+import json
+import numpy as np
+import SimpleITK as sitk
+from vtkmodules.util import numpy_support
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from pipeline_cache import pipeline_cache
+from profiling import traced
+
+RAW_CACHE_ENABLED = os.environ.get("PIPELINE_RAW_CACHE", "1") not in ("", "0")
+RAW_FORMAT_VERSION = 1
+
+def raw_volume_key(input_file):
+    # Hashing the contents would read the whole CT before the first preview slice is decoded
+    return pipeline_cache.stat_key(input_file, "raw_volume", version=RAW_FORMAT_VERSION)
+
+def image_geometry(image):
+    return {
+        "version": RAW_FORMAT_VERSION,
+        "size": list(image.GetSize()),
+        "spacing": list(image.GetSpacing()),
+        "origin": list(image.GetOrigin()),
+        "direction": list(image.GetDirection()),
+        "components": image.GetNumberOfComponentsPerPixel(),
+    }
+
+def write_raw_volume(key, image):
+    write_raw_array(key, sitk.GetArrayViewFromImage(image), image_geometry(image))
+
+@traced("raw_volume_write")
+def write_raw_array(key, array, geometry):
+    # The .npy goes last, a cached array is never visible without its geometry header
+    def write_header(path):
+        with open(path, "w") as f:
+            json.dump(geometry, f)
+    pipeline_cache.put(key, ".json", write_header)
+    pipeline_cache.put(key, ".npy", lambda path: np.save(path, array))
+
+def read_header(path):
+    with open(path) as f:
+        return json.load(f)
+
+@traced("raw_volume_open")
+def open_raw_volume(input_file):
+    key = raw_volume_key(input_file)
+    geometry = pipeline_cache.load(key, ".json", read_header)
+    if geometry is None or geometry.get("version") != RAW_FORMAT_VERSION:
+        return None, None
+    # Pages are read on demand and shared through the OS page cache between processes; the mapping
+    # outlives an eviction of the file
+    array = pipeline_cache.load(key, ".npy", lambda path: np.load(path, mmap_mode="r"))
+    if array is None:
+        return None, None
+    return array, geometry
+
+@traced("raw_volume_convert")
+def convert_to_raw(input_file):
+    reader = sitk.ImageFileReader()
+    reader.SetImageIO("NrrdImageIO")
+    reader.SetFileName(input_file)
+    image = reader.Execute()
+    write_raw_volume(raw_volume_key(input_file), image)
+    return open_raw_volume(input_file)
+
+def padded_bounds(bounding_box, size, padding=0):
+    # Inclusive (x, y, z) bounding box grown by padding voxels, as half-open index ranges clamped to the image
+    lower = [max(int(index) - padding, 0) for index in bounding_box[0]]
+    upper = [min(int(index) + padding + 1, size[axis]) for axis, index in enumerate(bounding_box[1])]
+    return lower, upper
+
+def index_to_physical(geometry, index):
+    # Same mapping SimpleITK uses: origin + direction * (index * spacing)
+    direction = np.array(geometry["direction"]).reshape(3, 3)
+    return (np.array(geometry["origin"]) + direction @ (np.array(index, dtype=float) * np.array(geometry["spacing"]))).tolist()
+
+def array_to_sitk(array, geometry):
+    # SimpleITK cannot wrap foreign memory, this is a plain memcpy out of the mapped pages
+    image = sitk.GetImageFromArray(array, isVector=geometry["components"] > 1)
+    image.SetSpacing(geometry["spacing"])
+    image.SetOrigin(geometry["origin"])
+    image.SetDirection(geometry["direction"])
+    return image
+
+def array_to_vtk(array, geometry):
+    # numpy_to_vtk keeps a reference to the memmap view, the mapping lives as long as the vtkImageData
+    components = geometry["components"]
+    vtk_array = numpy_support.numpy_to_vtk(array.reshape(-1) if components == 1 else array.reshape(-1, components), deep=False)
+    vtk_image = vtkImageData()
+    vtk_image.SetDimensions(geometry["size"])
+    vtk_image.SetSpacing(geometry["spacing"])
+    vtk_image.SetOrigin(geometry["origin"])
+    vtk_image.SetDirectionMatrix(geometry["direction"])
+    vtk_image.GetPointData().SetScalars(vtk_array)
+    return vtk_image
+
+def read_raw_vtk_image(input_file):
+    array, geometry = open_raw_volume(input_file)
+    if array is None:
+        array, geometry = convert_to_raw(input_file)
+    return array_to_vtk(array, geometry)
@@ -0,0 +1,217 @@
+import os
+import csv
+import sys
+import shutil
+import argparse
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+MASK_SUFFIX = "_CT_Masks.nrrd"
+CT_SUFFIX = "_CT.nrrd"
+MESH_EXTENSIONS = (".stl", ".vtp", ".ply", ".obj")
+THUMBNAIL_SIZE = 256
+# Fixed view so thumbnails of different cases line up in the browser; bump the version when rendering changes
+THUMBNAIL_VIEW = {"azimuth": 30.0, "elevation": 20.0, "background": (0.2, 0.3, 0.4), "version": 1}
+THUMBNAIL_FIELDS = ["name", "kind", "source", "label", "status", "cached"]
+
+# One offscreen window per worker process and size, the GL context is created once and reused
+snapshot_windows = {}
+
+def find_sources(input_dir, volumes=False):
+    jobs = []
+    for name in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, name)
+        if name.endswith(MASK_SUFFIX):
+            jobs.append({"kind": "label_map", "source": path, "name": name[:-len(MASK_SUFFIX)]})
+        elif volumes and name.endswith(CT_SUFFIX):
+            jobs.append({"kind": "volume", "source": path, "name": name[:-len(".nrrd")]})
+        elif name.lower().endswith(MESH_EXTENSIONS):
+            jobs.append({"kind": "mesh", "source": path, "name": os.path.splitext(name)[0]})
+    return jobs
+
+def init_worker(cache_dir):
+    from pipeline_cache import pipeline_cache
+    pipeline_cache.cache_dir = cache_dir
+
+def thumbnail_key(job, size):
+    from pipeline_cache import pipeline_cache
+    params = dict(THUMBNAIL_VIEW, kind=job["kind"], size=size)
+    if job["kind"] == "segment":
+        from data_processing import MESH_PARAMS, SEGMENT_PARAMS
+        params.update(label=float(job["label"]), **SEGMENT_PARAMS, **MESH_PARAMS)
+    elif job["kind"] == "volume":
+        from Rendering import DEFAULT_VOLUME_PRESET
+        params.update(preset=DEFAULT_VOLUME_PRESET)
+    return pipeline_cache.key(job["source"], "thumbnail", **params)
+
+def segment_jobs(label_map_job, label_values):
+    return [{"kind": "segment", "source": label_map_job["source"], "label": float(label_value),
+             "name": f"{label_map_job['name']}_label_{float(label_value)}"} for label_value in label_values]
+
+def prepare_label_map(label_map_file):
+    # Runs in a worker: finds the labels and splits the label map once, decoding it at most once,
+    # so the segment workers read their masks from the cache
+    import data_processing
+    from label_index import load_label_index, read_saved_label_index
+    from pipeline_cache import pipeline_cache
+    index = read_saved_label_index(label_map_file)
+    volume = None
+    if index is None:
+        volume = data_processing.read_label_map(label_map_file)
+        index = load_label_index(label_map_file, volume)
+    label_values = index["labels"]
+    if not all(pipeline_cache.get(data_processing.segment_cache_key(label_value, label_map_file), ".rle") for label_value in label_values):
+        data_processing.extract_all_segments(volume or data_processing.read_label_map(label_map_file), label_map_file, label_values)
+        data_processing.cache_writer.submit(lambda: None).result()
+    data_processing.memory_cache.clear()
+    return label_values
+
+def read_mesh_file(path):
+    from vtkmodules.vtkIOGeometry import vtkOBJReader, vtkSTLReader
+    from vtkmodules.vtkIOPLY import vtkPLYReader
+    from vtkmodules.vtkIOXML import vtkXMLPolyDataReader
+    readers = {".stl": vtkSTLReader, ".vtp": vtkXMLPolyDataReader, ".ply": vtkPLYReader, ".obj": vtkOBJReader}
+    reader = readers[os.path.splitext(path)[1].lower()]()
+    reader.SetFileName(path)
+    reader.Update()
+    return reader.GetOutput()
+
+def create_job_prop(job, size):
+    from Rendering import (DEFAULT_VOLUME_PRESET, VOLUME_PRESETS, VOLUME_PROXY_FACTORS, create_polydata_actor,
+                           create_volume_prop, create_volume_property, shrink_image_data)
+    if job["kind"] == "mesh":
+        return create_polydata_actor([read_mesh_file(job["source"])])
+    if job["kind"] == "segment":
+        import data_processing
+        return create_polydata_actor([data_processing.vtk2polydata(job["label"], job["source"])])
+    from raw_volume import read_raw_vtk_image
+    image_data = read_raw_vtk_image(job["source"])
+    # Rays are cast on the CPU, the coarsest proxy that still has a voxel per thumbnail pixel is enough
+    factor = max([factor for factor in VOLUME_PROXY_FACTORS if max(image_data.GetDimensions()) // factor >= size] or [1])
+    if factor > 1:
+        image_data = shrink_image_data(image_data, factor)
+    volume_property = create_volume_property(VOLUME_PRESETS[DEFAULT_VOLUME_PRESET])
+    return create_volume_prop([(1, image_data)], volume_property, volume_property, mapper_type="cpu")
+
+def offscreen_window(size):
+    from vtkmodules.vtkRenderingCore import vtkRenderer, vtkRenderWindow
+    if size not in snapshot_windows:
+        # Without a display VTK picks EGL or OSMesa for offscreen windows, no X server or GPU is needed
+        render_window = vtkRenderWindow()
+        render_window.SetOffScreenRendering(1)
+        render_window.SetSize(size, size)
+        renderer = vtkRenderer()
+        renderer.SetBackground(*THUMBNAIL_VIEW["background"])
+        render_window.AddRenderer(renderer)
+        snapshot_windows[size] = (render_window, renderer)
+    return snapshot_windows[size]
+
+def write_snapshot(prop, output_file, size=THUMBNAIL_SIZE):
+    from vtkmodules.vtkIOImage import vtkPNGWriter
+    from vtkmodules.vtkRenderingCore import vtkWindowToImageFilter
+    render_window, renderer = offscreen_window(size)
+    renderer.RemoveAllViewProps()
+    renderer.AddViewProp(prop)
+    camera = renderer.GetActiveCamera()
+    camera.SetPosition(0.0, 0.0, 1.0)
+    camera.SetFocalPoint(0.0, 0.0, 0.0)
+    camera.SetViewUp(0.0, 1.0, 0.0)
+    camera.Azimuth(THUMBNAIL_VIEW["azimuth"])
+    camera.Elevation(THUMBNAIL_VIEW["elevation"])
+    camera.OrthogonalizeViewUp()
+    renderer.ResetCamera()
+    render_window.Render()
+    window_to_image = vtkWindowToImageFilter()
+    window_to_image.SetInput(render_window)
+    window_to_image.ReadFrontBufferOff()
+    window_to_image.Update()
+    writer = vtkPNGWriter()
+    writer.SetFileName(output_file)
+    writer.SetInputConnection(window_to_image.GetOutputPort())
+    writer.Write()
+    renderer.RemoveAllViewProps()
+
+def render_thumbnail(job, key, output_file, size=THUMBNAIL_SIZE):
+    from pipeline_cache import pipeline_cache
+    path = pipeline_cache.put(key, ".png", lambda path: write_snapshot(create_job_prop(job, size), path, size))
+    shutil.copyfile(path, output_file)
+    return output_file
+
+def snapshot_job(job, output_file, size=THUMBNAIL_SIZE):
+    # Hashing the source for the key happens here in the worker; returns 1 on a cache hit
+    from pipeline_cache import pipeline_cache
+    key = thumbnail_key(job, size)
+    if pipeline_cache.load(key, ".png", lambda path: shutil.copyfile(path, output_file)) is not None:
+        return 1
+    render_thumbnail(job, key, output_file, size)
+    return 0
+
+def run_snapshots(jobs, output_dir, workers, cache_dir, size=THUMBNAIL_SIZE):
+    os.makedirs(output_dir, exist_ok=True)
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(cache_dir,)) as executor:
+        # The parent only submits: label discovery and key hashing run in the workers, and a label map's
+        # segment thumbnails are submitted as soon as its prepare job reports the labels
+        prepare_futures = {}
+        thumbnail_futures = {}
+
+        def submit_thumbnail(job):
+            row = {"name": f"{job['name']}.png", "kind": job["kind"], "source": job["source"], "label": job.get("label", ""), "cached": 0}
+            rows.append(row)
+            future = executor.submit(snapshot_job, job, os.path.join(output_dir, row["name"]), size)
+            thumbnail_futures[future] = row
+            return future
+
+        for job in jobs:
+            if job["kind"] == "label_map":
+                prepare_futures[executor.submit(prepare_label_map, job["source"])] = job
+            else:
+                submit_thumbnail(job)
+        pending = set(prepare_futures) | set(thumbnail_futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in prepare_futures:
+                    job = prepare_futures[future]
+                    try:
+                        label_values = future.result()
+                    except Exception:
+                        traceback.print_exc()
+                        rows.append({"name": job["name"], "kind": job["kind"], "source": job["source"], "label": "", "status": "failed", "cached": 0})
+                        print(f"{job['name']}: failed")
+                        continue
+                    pending.update(submit_thumbnail(segment_job) for segment_job in segment_jobs(job, label_values))
+                    continue
+                row = thumbnail_futures[future]
+                try:
+                    row["cached"] = future.result()
+                    row["status"] = "ok"
+                except Exception:
+                    traceback.print_exc()
+                    row["status"] = "failed"
+                print(f"{row['name']}: {row['status']}")
+    with open(os.path.join(output_dir, "thumbnails.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=THUMBNAIL_FIELDS)
+        writer.writeheader()
+        writer.writerows(sorted(rows, key=lambda row: row["name"]))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render fixed-view PNG thumbnails of meshes, segments and CT volumes without a display")
+    parser.add_argument("--input-dir", required=True,
+                        help=f"directory with mesh files ({', '.join(MESH_EXTENSIONS)}) and/or <case>{MASK_SUFFIX} label maps")
+    parser.add_argument("--output-dir", default=os.path.join("output", "thumbnails"))
+    parser.add_argument("--cache-dir", default=os.path.join("output", "cache"))
+    parser.add_argument("--size", type=int, default=THUMBNAIL_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--volumes", action="store_true", help=f"also render <case>{CT_SUFFIX} volumes with the CPU ray cast mapper")
+    args = parser.parse_args(argv)
+    jobs = find_sources(args.input_dir, args.volumes)
+    if not jobs:
+        print("No meshes or label maps found.")
+        return 1
+    rows = run_snapshots(jobs, args.output_dir, args.workers, args.cache_dir, args.size)
+    return 0 if all(row["status"] == "ok" for row in rows) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
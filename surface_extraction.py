@@ -0,0 +1,67 @@
+import os
+import numpy as np
+from vtkmodules.util import numpy_support
+from vtkmodules.vtkCommonCore import VTK_ID_TYPE, vtkFloatArray, vtkPoints, vtkSMPTools
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData
+from vtkmodules.vtkFiltersGeneral import vtkDiscreteFlyingEdges3D
+from profiling import traced
+
+SMP_BACKEND = os.environ.get("VTK_SMP_BACKEND", "STDThread")
+
+def configure_smp(number_of_threads=0):
+    # 0 lets VTK use every core; the Sequential backend ignores the thread count
+    vtkSMPTools.SetBackend(SMP_BACKEND)
+    vtkSMPTools.Initialize(number_of_threads)
+    return vtkSMPTools.GetEstimatedNumberOfThreads()
+
+@traced("discrete_flying_edges")
+def extract_label_surfaces(label_image, label_values, number_of_threads=0):
+    # One discrete flying edges pass contours every requested label of the label map
+    configure_smp(number_of_threads)
+    flying_edges = vtkDiscreteFlyingEdges3D()
+    flying_edges.SetInputData(label_image)
+    flying_edges.SetNumberOfContours(len(label_values))
+    for i, label_value in enumerate(label_values):
+        flying_edges.SetValue(i, label_value)
+    flying_edges.ComputeNormalsOff()
+    flying_edges.ComputeGradientsOff()
+    flying_edges.ComputeScalarsOn()
+    flying_edges.Update()
+    return split_surfaces_by_label(flying_edges.GetOutput(), label_values)
+
+@traced("split_surfaces_by_label")
+def split_surfaces_by_label(surfaces, label_values):
+    points = numpy_support.vtk_to_numpy(surfaces.GetPoints().GetData()) if surfaces.GetNumberOfPoints() else np.empty((0, 3))
+    triangles = numpy_support.vtk_to_numpy(surfaces.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+    point_labels = numpy_support.vtk_to_numpy(surfaces.GetPointData().GetScalars()) if surfaces.GetNumberOfPoints() else np.empty(0)
+    # Every triangle of a discrete contour carries its label on all three points
+    triangle_labels = point_labels[triangles[:, 0]]
+    order = np.argsort(triangle_labels, kind="stable")
+    sorted_labels = triangle_labels[order]
+    poly_data_by_label = {}
+    for label_value in label_values:
+        start = np.searchsorted(sorted_labels, label_value, side="left")
+        end = np.searchsorted(sorted_labels, label_value, side="right")
+        label_triangles = triangles[order[start:end]]
+        poly_data_by_label[float(label_value)] = triangles_to_polydata(points, label_triangles, label_value)
+    return poly_data_by_label
+
+def triangles_to_polydata(points, triangles, label_value):
+    used_points, remapped = np.unique(triangles.ravel(), return_inverse=True)
+    vtk_points = vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(points[used_points]), deep=True))
+    offsets = np.arange(0, remapped.size + 1, 3, dtype=np.int64)
+    cells = vtkCellArray()
+    cells.SetData(numpy_support.numpy_to_vtk(offsets, deep=True, array_type=VTK_ID_TYPE),
+                  numpy_support.numpy_to_vtk(remapped.astype(np.int64), deep=True, array_type=VTK_ID_TYPE))
+    poly_data = vtkPolyData()
+    poly_data.SetPoints(vtk_points)
+    poly_data.SetPolys(cells)
+    label_ids = numpy_support.numpy_to_vtk(np.full(len(triangles), label_value, dtype=np.float32), deep=True)
+    label_ids.SetName("Label")
+    poly_data.GetCellData().SetScalars(label_ids)
+    label_field = vtkFloatArray()
+    label_field.SetName("LabelValue")
+    label_field.InsertNextValue(label_value)
+    poly_data.GetFieldData().AddArray(label_field)
+    return poly_data
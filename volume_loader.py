@@ -0,0 +1,137 @@
+import time
+import zlib
+import numpy as np
+import SimpleITK as sitk
+from raw_volume import RAW_CACHE_ENABLED, RAW_FORMAT_VERSION, image_geometry, open_raw_volume, raw_volume_key, write_raw_array
+from profiling import traced
+
+PREVIEW_STRIDE = 4
+PREVIEW_INTERVAL_S = 0.25
+CHUNK_BYTES = 4 * 1024 * 1024
+NRRD_TYPES = {
+    "int8": "i1", "int8_t": "i1", "signed char": "i1",
+    "uint8": "u1", "uint8_t": "u1", "uchar": "u1", "unsigned char": "u1",
+    "int16": "i2", "int16_t": "i2", "short": "i2", "short int": "i2", "signed short": "i2", "signed short int": "i2",
+    "uint16": "u2", "uint16_t": "u2", "ushort": "u2", "unsigned short": "u2", "unsigned short int": "u2",
+    "int32": "i4", "int32_t": "i4", "int": "i4", "signed int": "i4",
+    "uint32": "u4", "uint32_t": "u4", "uint": "u4", "unsigned int": "u4",
+    "int64": "i8", "int64_t": "i8", "longlong": "i8", "long long": "i8", "long long int": "i8",
+    "signed long long": "i8", "signed long long int": "i8",
+    "uint64": "u8", "uint64_t": "u8", "ulonglong": "u8", "unsigned long long": "u8", "unsigned long long int": "u8",
+    "float": "f4", "double": "f8",
+}
+# NRRD spaces are converted to LPS like ITK does, by negating the flipped world axes
+SPACE_FLIPS = {
+    "left-posterior-superior": (1, 1, 1), "lps": (1, 1, 1),
+    "right-anterior-superior": (-1, -1, 1), "ras": (-1, -1, 1),
+    "left-anterior-superior": (1, -1, 1), "las": (1, -1, 1),
+}
+
+class LoadCancelled(Exception):
+    pass
+
+def read_nrrd_header(f):
+    if not f.readline().startswith(b"NRRD"):
+        return None
+    fields = {}
+    for line in iter(f.readline, b""):
+        line = line.decode("latin-1").rstrip("\r\n")
+        if not line:
+            break
+        if line.startswith("#") or ":=" in line:
+            continue
+        key, _, value = line.partition(":")
+        fields[key.strip().lower()] = value.strip()
+    return fields
+
+def parse_vector(text):
+    return [float(value) for value in text.strip().strip("()").split(",")]
+
+def nrrd_geometry(fields):
+    # Only the plain single component 3D layout is streamed, everything else goes through SimpleITK
+    sizes = [int(size) for size in fields.get("sizes", "").split()]
+    if fields.get("dimension") != "3" or len(sizes) != 3 or fields.get("type") not in NRRD_TYPES:
+        return None
+    if fields.get("encoding") not in ("raw", "gzip", "gz") or "data file" in fields or "datafile" in fields:
+        return None
+    if int(fields.get("byte skip", fields.get("byteskip", 0))) or int(fields.get("line skip", fields.get("lineskip", 0))):
+        return None
+    flips = SPACE_FLIPS.get(fields.get("space", "left-posterior-superior").lower())
+    if flips is None:
+        return None
+    if "space directions" in fields:
+        axes = np.array([parse_vector(axis) for axis in fields["space directions"].split()]) * flips
+        spacing = np.linalg.norm(axes, axis=1)
+        direction = (axes / spacing[:, None]).T
+    else:
+        spacing = np.array([float(value) for value in fields.get("spacings", "1 1 1").split()])
+        direction = np.diag(flips).astype(float)
+    origin = np.array(parse_vector(fields["space origin"])) * flips if "space origin" in fields else np.zeros(3)
+    return {
+        "version": RAW_FORMAT_VERSION,
+        "size": sizes,
+        "spacing": spacing.tolist(),
+        "origin": origin.tolist(),
+        "direction": direction.ravel().tolist(),
+        "components": 1,
+    }
+
+def nrrd_dtype(fields):
+    dtype = np.dtype(NRRD_TYPES[fields["type"]])
+    if dtype.itemsize > 1:
+        dtype = dtype.newbyteorder("<" if fields.get("endian", "little") == "little" else ">")
+    return dtype
+
+def preview_volume(array, geometry, stride=PREVIEW_STRIDE):
+    # Strided sampling keeps the origin, the spacing grows by the stride
+    preview = np.ascontiguousarray(array[::stride, ::stride, ::stride], dtype=array.dtype.newbyteorder("="))
+    preview_geometry = dict(geometry, size=list(preview.shape[::-1]), spacing=[spacing * stride for spacing in geometry["spacing"]])
+    return preview, preview_geometry
+
+@traced("progressive_load")
+def load_volume(filename, progress=None, preview=None, cancelled=None):
+    # Returns (array, geometry, cached); arrays are (z, y, x) like SimpleITK's
+    if RAW_CACHE_ENABLED:
+        array, geometry = open_raw_volume(filename)
+        if array is not None:
+            return array, geometry, True
+    with open(filename, "rb") as f:
+        fields = read_nrrd_header(f)
+        geometry = nrrd_geometry(fields) if fields is not None else None
+        if geometry is None:
+            image = sitk.ReadImage(filename)
+            return sitk.GetArrayFromImage(image), image_geometry(image), False
+        array = np.zeros(geometry["size"][::-1], dtype=nrrd_dtype(fields))
+        buffer = array.reshape(-1).view(np.uint8)
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32) if fields["encoding"] != "raw" else None
+        position = 0
+        last_preview = time.perf_counter()
+        while position < buffer.size:
+            if cancelled is not None and cancelled():
+                raise LoadCancelled(filename)
+            step = min(CHUNK_BYTES, buffer.size - position)
+            if decompressor is None:
+                read = f.readinto(buffer[position:position + step])
+            else:
+                # Output per step is bounded so highly compressible masks still report progress;
+                # input held back by max_length is fed again before reading more of the file
+                chunk = decompressor.unconsumed_tail or f.read(CHUNK_BYTES)
+                data = decompressor.decompress(chunk, step) if chunk else b""
+                read = len(data)
+                buffer[position:position + read] = np.frombuffer(data, dtype=np.uint8)
+            if not read and (decompressor is None or not chunk):
+                raise ValueError(f"{filename} ends after {position} of {buffer.size} data bytes")
+            position += read
+            if progress is not None:
+                progress(position / buffer.size)
+            if preview is not None and time.perf_counter() - last_preview > PREVIEW_INTERVAL_S and position < buffer.size:
+                # Slices not decoded yet are still zero and stay transparent
+                preview(*preview_volume(array, geometry))
+                last_preview = time.perf_counter()
+    if not array.dtype.isnative:
+        array = array.astype(array.dtype.newbyteorder("="))
+    return array, geometry, False
+
+def cache_loaded_volume(filename, array, geometry):
+    if RAW_CACHE_ENABLED:
+        write_raw_array(raw_volume_key(filename), array, geometry)
@@ -0,0 +1,167 @@
+import traceback
+import threading
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+
+class WorkerSignals(QObject):
+    finished = pyqtSignal(object, object)
+    error = pyqtSignal(object, str)
+
+class PipelineWorker(QRunnable):
+    def __init__(self, key, fn, *args):
+        super(PipelineWorker, self).__init__()
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.signals = WorkerSignals()
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            result = self.fn(*self.args)
+        except Exception:
+            self.signals.error.emit(self.key, traceback.format_exc())
+        else:
+            self.signals.finished.emit(self.key, result)
+
+class PipelineTaskManager(QObject):
+    # Results are delivered on the thread that owns the manager (the Qt main thread)
+    task_finished = pyqtSignal(object, object)
+    task_failed = pyqtSignal(object, str)
+
+    def __init__(self, max_threads=None):
+        super(PipelineTaskManager, self).__init__()
+        self.thread_pool = QThreadPool.globalInstance()
+        if max_threads is not None:
+            self.thread_pool.setMaxThreadCount(max_threads)
+        self.in_flight = {}
+
+    def is_running(self, key):
+        return key in self.in_flight
+
+    def submit(self, key, fn, *args, callback=None):
+        # A request already in flight for the same key is joined instead of started again;
+        # every requester is remembered, with or without a callback, so each one hears about a failure
+        if key in self.in_flight:
+            self.in_flight[key].append(callback)
+            return False
+        self.in_flight[key] = [callback]
+        worker = PipelineWorker(key, fn, *args)
+        worker.signals.finished.connect(self.on_worker_finished)
+        worker.signals.error.connect(self.on_worker_error)
+        self.thread_pool.start(worker)
+        return True
+
+    @pyqtSlot(object, object)
+    def on_worker_finished(self, key, result):
+        callbacks = self.in_flight.pop(key, [])
+        for callback in callbacks:
+            if callback is not None:
+                callback(result)
+        self.task_finished.emit(key, result)
+
+    @pyqtSlot(object, str)
+    def on_worker_error(self, key, message):
+        for _ in self.in_flight.pop(key, [None]):
+            self.task_failed.emit(key, message)
+
+    def wait_for_done(self, msecs=-1):
+        return self.thread_pool.waitForDone(msecs)
+
+class VolumeLoadSignals(QObject):
+    preview = pyqtSignal(int, object)
+    progress = pyqtSignal(int, float)
+    loaded = pyqtSignal(int, object)
+    cancelled = pyqtSignal(int)
+    error = pyqtSignal(int, str)
+
+class VolumeLoadWorker(QRunnable):
+    def __init__(self, token, filename, prepare=None):
+        super(VolumeLoadWorker, self).__init__()
+        self.token = token
+        self.filename = filename
+        self.prepare = prepare
+        self.cancel_requested = threading.Event()
+        self.signals = VolumeLoadSignals()
+
+    def cancel(self):
+        self.cancel_requested.set()
+
+    @pyqtSlot()
+    def run(self):
+        # NumPy/SimpleITK are imported here, off the GUI thread
+        from volume_loader import LoadCancelled, cache_loaded_volume, load_volume
+        from raw_volume import array_to_vtk
+        try:
+            array, geometry, cached = load_volume(
+                self.filename,
+                progress=lambda fraction: self.signals.progress.emit(self.token, fraction),
+                preview=lambda preview, preview_geometry: self.signals.preview.emit(self.token, array_to_vtk(preview, preview_geometry)),
+                cancelled=self.cancel_requested.is_set)
+            image_data = array_to_vtk(array, geometry)
+            if self.cancel_requested.is_set():
+                raise LoadCancelled(self.filename)
+            self.signals.loaded.emit(self.token, self.prepare(image_data) if self.prepare is not None else image_data)
+            if not cached:
+                cache_loaded_volume(self.filename, array, geometry)
+        except LoadCancelled:
+            self.signals.cancelled.emit(self.token)
+        except Exception:
+            self.signals.error.emit(self.token, traceback.format_exc())
+
+class VolumeLoader(QObject):
+    # Only the most recent load is reported, picking another file cancels the one in flight
+    preview_ready = pyqtSignal(str, object)
+    progress = pyqtSignal(str, float)
+    loaded = pyqtSignal(str, object)
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, prepare=None):
+        super(VolumeLoader, self).__init__()
+        # prepare runs on the worker thread on the loaded vtkImageData, its result is what loaded carries
+        self.prepare = prepare
+        self.thread_pool = QThreadPool.globalInstance()
+        self.token = 0
+        self.filename = None
+        self.worker = None
+
+    def load(self, filename):
+        self.cancel()
+        self.token += 1
+        self.filename = filename
+        self.worker = VolumeLoadWorker(self.token, filename, self.prepare)
+        self.worker.signals.preview.connect(self.on_preview)
+        self.worker.signals.progress.connect(self.on_progress)
+        self.worker.signals.loaded.connect(self.on_loaded)
+        self.worker.signals.error.connect(self.on_error)
+        self.thread_pool.start(self.worker)
+        return self.token
+
+    def cancel(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+    def is_current(self, token):
+        return self.worker is not None and token == self.token
+
+    @pyqtSlot(int, object)
+    def on_preview(self, token, image_data):
+        if self.is_current(token):
+            self.preview_ready.emit(self.filename, image_data)
+
+    @pyqtSlot(int, float)
+    def on_progress(self, token, fraction):
+        if self.is_current(token):
+            self.progress.emit(self.filename, fraction)
+
+    @pyqtSlot(int, object)
+    def on_loaded(self, token, image_data):
+        if self.is_current(token):
+            self.worker = None
+            self.loaded.emit(self.filename, image_data)
+
+    @pyqtSlot(int, str)
+    def on_error(self, token, message):
+        if self.is_current(token):
+            self.worker = None
+            self.failed.emit(self.filename, message)